@@ -1,14 +1,14 @@
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from transport import Transport
 import os
 import pickle
 from config import CONFIG
 
 class AuthManager:
     @staticmethod
-    def get_drive_service(credentials_file, token_file):
+    def get_credentials(credentials_file, token_file):
         creds = None
         if os.path.exists(token_file):
             with open(token_file, 'rb') as token:
@@ -25,4 +25,21 @@ class AuthManager:
             with open(token_file, 'wb') as token:
                 pickle.dump(creds, token)
 
-        return build('drive', 'v3', credentials=creds)
+        return creds
+
+    @staticmethod
+    def token_file(account, user=None):
+        """Token path of the 'source' or 'dest' account, kept apart per migrated user"""
+        token_dir = os.path.join(CONFIG['TOKEN_DIR'], user) if user else CONFIG['TOKEN_DIR']
+        os.makedirs(token_dir, exist_ok=True)
+        return os.path.join(token_dir, f'{account}_token.pickle')
+
+    @staticmethod
+    def build_service(creds):
+        """Service for the calling thread only, parallel code gives every thread its own"""
+        return Transport(creds).build_service()
+
+    @staticmethod
+    def get_drive_service(credentials_file, token_file):
+        creds = AuthManager.get_credentials(credentials_file, token_file)
+        return AuthManager.build_service(creds)
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+from auth_manager import AuthManager
+from drive_manager import DriveManager
+from config import CONFIG
+
+
+def authorize(migrations):
+    """Create or refresh every user's tokens up front, the OAuth flow cannot run inside a worker"""
+    for migration in migrations:
+        user = migration['source_email']
+        AuthManager.get_credentials(CONFIG['SOURCE_CREDENTIALS_FILE'], AuthManager.token_file('source', user))
+        AuthManager.get_credentials(CONFIG['DEST_CREDENTIALS_FILE'], AuthManager.token_file('dest', user))
+
+
+def migrate_user(migration):
+    """Migrate one user's My Drive, and optionally shared drives, in a worker process.
+
+    Each user gets its own DriveManager, so tokens, staging directory,
+    state store and log all live under the user's own namespace.
+    """
+    source_email = migration['source_email']
+    destination_email = migration['destination_email']
+    source_domain = migration.get('source_domain')
+    target_domain = migration.get('target_domain')
+    result = {'source_email': source_email, 'destination_email': destination_email, 'files': 0, 'error': None}
+
+    drive_manager = DriveManager(source_email)
+    try:
+        logging.info(f"=== Starting migration from {source_email} to {destination_email} ===")
+        if migration.get('plan_only'):
+            plan = drive_manager.plan_migration(source_email, source_domain, target_domain)
+            result['plan'] = plan['estimate']
+        elif migration.get('direct_transfer'):
+            drive_manager.stream_drive(source_email, destination_email, source_domain, target_domain)
+        else:
+            zip_path = drive_manager.download_drive(source_email)
+            extract_path = drive_manager.extract_drive(zip_path)
+            drive_manager.upload_drive(extract_path, destination_email, source_domain, target_domain)
+            drive_manager.cleanup_staging()
+        if migration.get('shared_drives') and not migration.get('plan_only'):
+            failed = drive_manager.migrate_shared_drives(source_email, destination_email, source_domain, target_domain)
+            if failed:
+                result['error'] = f"Shared drives failed: {', '.join(failed)}"
+        result['files'] = drive_manager.current_file_count
+        logging.info(f"=== Migration completed for {source_email} to {destination_email} ===")
+    except Exception as e:
+        logging.error(f"Migration failed for {source_email}: {str(e)}")
+        result['error'] = str(e)
+    finally:
+        drive_manager.close()
+    return result
+
+
+def run_batch(migrations, workers=None):
+    """Migrate several users at once, CONFIG['MIGRATION_WORKERS'] processes by default.
+
+    Drive quotas are per user, so users running side by side do not slow
+    each other down. Returns one result dict per migration.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    authorize(migrations)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or CONFIG['MIGRATION_WORKERS']) as executor:
+        futures = {executor.submit(migrate_user, migration): migration for migration in migrations}
+        for future in as_completed(futures):
+            migration = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died
+                result = {
+                    'source_email': migration['source_email'],
+                    'destination_email': migration['destination_email'],
+                    'files': 0,
+                    'error': str(e)
+                }
+            results.append(result)
+            if result['error']:
+                logging.error(f"{result['source_email']} failed: {result['error']}")
+            else:
+                logging.info(f"{result['source_email']} done, {result['files']} files")
+
+    failed = sum(1 for result in results if result['error'])
+    logging.info(f"Batch finished: {len(results) - failed} succeeded, {failed} failed")
+    return results
@@ -0,0 +1,197 @@
+"""Offline benchmark of the migration engine against fake_drive.
+
+Runs the download, upload, permission and direct transfer paths on a
+synthetic tree and reports files/s, MB/s, API calls and peak RSS, e.g.
+
+    python benchmark.py --shape tiny --latency 0.02
+    python benchmark.py --shape huge --bandwidth 50000000 --throttle-rate 0.01
+
+The request executor's RATE_LIMITS still apply against the fake service,
+so a shape of small files is bounded by the media limit as well as by the
+worker counts. --rate-limit endpoint=rate lowers or raises a limit to
+see its effect, and the limits in effect are printed and saved with the
+report.
+"""
+from datetime import datetime
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+from drive_manager import DriveManager
+from fake_drive import FakeCloud, SHAPES
+from config import CONFIG
+
+SOURCE = 'bench@source.test'
+DESTINATION = 'bench@dest.test'
+STREAM_DESTINATION = 'bench-stream@dest.test'
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def api_calls(metrics):
+    with metrics.lock:
+        return sum(
+            value for (name, _), value in metrics.counters.items()
+            if name in ('api_requests_total', 'api_errors_total')
+        )
+
+
+def measure(name, func, drive_manager, files, size):
+    calls = api_calls(drive_manager.metrics)
+    start = time.monotonic()
+    func()
+    elapsed = max(time.monotonic() - start, 0.001)
+    return {
+        'path': name,
+        'seconds': round(elapsed, 2),
+        'files': files,
+        'files_per_second': round(files / elapsed, 2),
+        'mb_per_second': round(size / 1048576 / elapsed, 2),
+        'api_calls': int(api_calls(drive_manager.metrics) - calls),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def new_drive_manager(cloud, name, destination, verbose):
+    accounts = {'source': SOURCE, 'dest': destination}
+    user = f"benchmark_{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    drive_manager = DriveManager(user, service_factory=lambda account: cloud.service(accounts[account]))
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    return drive_manager
+
+
+def run(args):
+    shape = dict(SHAPES[args.shape])
+    for key in ('folders', 'depth', 'files', 'size'):
+        if getattr(args, key) is not None:
+            shape[key] = getattr(args, key)
+    if args.download_workers:
+        CONFIG['DOWNLOAD_WORKERS'] = args.download_workers
+    if args.upload_workers:
+        CONFIG['UPLOAD_WORKERS'] = args.upload_workers
+    for limit in args.rate_limit:
+        endpoint, rate = limit.split('=')
+        concurrency = CONFIG['RATE_LIMITS'].get(endpoint, CONFIG['RATE_LIMITS']['default'])[1]
+        CONFIG['RATE_LIMITS'][endpoint] = (float(rate), concurrency)
+
+    cloud = FakeCloud(
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed
+    )
+    files, size = cloud.populate(SOURCE, **shape)
+    for item in list(cloud.files.values()):
+        if item['owner'] == SOURCE and not item['id'].startswith('root-'):
+            # One colleague per item so the permission path has work to do
+            permission = {'id': cloud.new_id('p'), 'type': 'user', 'role': 'writer',
+                          'emailAddress': f"colleague{item['id']}@source.test"}
+            item['permissions'].append(permission)
+            item['permissionIds'].append(permission['id'])
+    print(f"Shape {args.shape}: {files} files, {size / 1048576:.1f} MB, latency {args.latency}s")
+    limits = ', '.join(f"{endpoint} {rate:g}/s" for endpoint, (rate, _) in sorted(CONFIG['RATE_LIMITS'].items()))
+    print(f"Rate limits: {limits}")
+
+    results = []
+    paths = args.paths.split(',')
+    # Permissions need uploaded items, uploads need a downloaded archive
+    upload = 'upload' in paths or 'permissions' in paths
+    if upload or 'download' in paths:
+        drive_manager = new_drive_manager(cloud, args.shape, DESTINATION, args.verbose)
+        try:
+            staged = {}
+            results.append(measure(
+                'download', lambda: staged.update(zip_path=drive_manager.download_drive(SOURCE)),
+                drive_manager, files, size
+            ))
+            zip_path = staged['zip_path']
+            if upload:
+                extract_path = drive_manager.extract_drive(zip_path)
+                results.append(measure(
+                    'upload', lambda: drive_manager.upload_drive(extract_path, DESTINATION, None, None),
+                    drive_manager, files, size
+                ))
+            if 'permissions' in paths:
+                mapping = drive_manager.state.file_mapping()
+
+                def migrate_permissions():
+                    for source_id, dest_id in mapping.items():
+                        drive_manager.permission_batcher.add(
+                            source_id, dest_id, 'source.test', 'dest.test',
+                            cloud.files[source_id]['permissions']
+                        )
+                    drive_manager.permission_batcher.flush()
+                results.append(measure('permissions', migrate_permissions, drive_manager, len(mapping), 0))
+        finally:
+            drive_manager.close()
+            shutil.rmtree(drive_manager.work_dir, ignore_errors=True)
+
+    if 'stream' in paths:
+        drive_manager = new_drive_manager(cloud, f'{args.shape}_stream', STREAM_DESTINATION, args.verbose)
+        try:
+            results.append(measure(
+                'stream', lambda: drive_manager.stream_drive(SOURCE, STREAM_DESTINATION),
+                drive_manager, files, size
+            ))
+        finally:
+            drive_manager.close()
+            shutil.rmtree(drive_manager.work_dir, ignore_errors=True)
+
+    print(f"{'path':<12}{'seconds':>9}{'files/s':>10}{'MB/s':>9}{'API calls':>11}{'peak RSS MB':>13}")
+    for result in results:
+        rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+        print(f"{result['path']:<12}{result['seconds']:>9}{result['files_per_second']:>10}"
+              f"{result['mb_per_second']:>9}{result['api_calls']:>11}{rss:>13}")
+
+    report = os.path.join(
+        CONFIG['LOG_DIR'], f"benchmark_{args.shape}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    with open(report, 'w', encoding='utf-8') as f:
+        json.dump({
+            'shape': shape,
+            'arguments': vars(args),
+            'rate_limits': CONFIG['RATE_LIMITS'],
+            'results': results
+        }, f, indent=2)
+    print(f"Report written to {report}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the migration engine against a simulated Drive")
+    parser.add_argument('--shape', choices=sorted(SHAPES), default='mixed')
+    parser.add_argument('--folders', type=int, help="Folders per level (overrides the shape)")
+    parser.add_argument('--depth', type=int, help="Folder levels (overrides the shape)")
+    parser.add_argument('--files', type=int, help="Files per folder (overrides the shape)")
+    parser.add_argument('--size', type=int, help="Bytes per file (overrides the shape)")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every API call")
+    parser.add_argument('--bandwidth', type=float, help="Bytes per second of a single media request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls failing with a 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Share of calls failing with a 429")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--paths', default='download,upload,permissions,stream',
+                        help="Comma separated: download, upload, permissions, stream")
+    parser.add_argument('--download-workers', type=int)
+    parser.add_argument('--upload-workers', type=int)
+    parser.add_argument('--rate-limit', action='append', default=[], metavar='ENDPOINT=RATE',
+                        help="Requests per second for an endpoint class, e.g. media=200 (repeatable)")
+    parser.add_argument('--verbose', action='store_true', help="Keep per-file INFO logging")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
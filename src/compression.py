@@ -0,0 +1,36 @@
+import os
+import time
+import zipfile
+from config import CONFIG
+
+
+def _mime_type_for(file_path, mime_type=None):
+    """Resolve a MIME type from the archive path, falling back to the Drive one"""
+    extension = os.path.splitext(file_path)[1].lower()
+    return CONFIG['SUPPORTED_MIME_TYPES'].get(extension, mime_type or '')
+
+
+def compression_for(file_path, mime_type=None):
+    """Pick (compress_type, compresslevel) for an archive member.
+
+    Content that is already compressed (the image, audio/video and archive
+    formats listed in CONFIG and the Office formats Workspace files are
+    exported to) is stored as is, deflating it again costs CPU for next to
+    no size gain. Uncompressed media such as BMP, TIFF or SVG is deflated.
+    """
+    resolved = _mime_type_for(file_path, mime_type)
+    extension = os.path.splitext(file_path)[1].lower()
+    if resolved in CONFIG['STORED_MIME_TYPES'] or extension in CONFIG['STORED_EXTENSIONS']:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, CONFIG['ZIP_COMPRESS_LEVEL']
+
+
+def zip_info_for(file_path, mime_type=None):
+    """Build a ZipInfo carrying the compression policy for ZipFile.open(..., 'w')"""
+    zinfo = zipfile.ZipInfo(file_path, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type, level = compression_for(file_path, mime_type)
+    if hasattr(zinfo, 'compress_level'):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+    return zinfo
@@ -38,10 +38,102 @@ CONFIG = {
         # Archives
         '.zip': 'application/zip',
         '.rar': 'application/x-rar-compressed'
-    }
+    },
+    # Google Workspace types and the format each one is exported to
+    'WORKSPACE_EXPORT_FORMATS': {
+        'application/vnd.google-apps.document': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx'),
+        'application/vnd.google-apps.spreadsheet': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+        'application/vnd.google-apps.presentation': ('application/vnd.openxmlformats-officedocument.presentationml.presentation', '.pptx'),
+        'application/vnd.google-apps.drawing': ('application/pdf', '.pdf'),
+        'application/vnd.google-apps.script': ('application/json', '.json'),
+        'application/vnd.google-apps.form': ('application/pdf', '.pdf')
+    },
+    # Transfer buffers
+    'SPOOL_MAX_MEMORY': 8 * 1024 * 1024,  # Downloads larger than this spill to a temp file
+    'DOWNLOAD_CHUNK_SIZE': 8 * 1024 * 1024,
+    'RANGED_DOWNLOAD_THRESHOLD': 256 * 1024 * 1024,  # Files at least this big download as parallel Range segments
+    'RANGED_DOWNLOAD_SEGMENTS': 4,  # Segment threads shared by all ranged downloads
+    # Staging archive compression
+    'ZIP_COMPRESS_LEVEL': 6,
+    'STORED_MIME_TYPES': [
+        # Already compressed, stored without deflate
+        'application/zip',
+        'application/x-rar-compressed',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+        'audio/mpeg',
+        'audio/aac',
+        'audio/ogg',
+        'video/mp4',
+        'video/x-msvideo',
+        'video/quicktime',
+        'video/webm',
+        'video/x-matroska',
+        'video/mpeg',
+        'image/jpeg',
+        'image/png',
+        'image/gif',
+        'image/webp',
+        'image/heic',
+        'image/heif',
+        'application/gzip',
+        'application/x-7z-compressed'
+    ],
+    # Same, by file extension, for files whose MIME type is unknown
+    'STORED_EXTENSIONS': {
+        '.zip', '.rar', '.7z', '.gz', '.tgz', '.docx', '.xlsx', '.pptx',
+        '.mp3', '.aac', '.ogg', '.mp4', '.m4v', '.mov', '.avi', '.webm', '.mkv',
+        '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif'
+    },
+    # Workspace exports, cached outside TEMP_DIR so cleanup and new runs keep them
+    'EXPORT_CACHE_DIR': 'export_cache',
+    'EXPORT_CACHE_MAX_BYTES': 2 * 1024 * 1024 * 1024,  # Least recently used exports are evicted above this
+    'EXPORT_WORKERS': 4,  # Exports run on their own threads, next to the binary downloads
+    'STREAM_QUEUE_SIZE': 8,  # Downloaded files waiting for an upload worker in direct transfers
+    'UPLOAD_CHUNK_SIZE': 8 * 1024 * 1024,  # Multiple of 256 KB, upload progress is saved after every chunk
+    # Parallel transfers
+    'DOWNLOAD_WORKERS': 8,
+    'UPLOAD_WORKERS': 8,
+    # Server side copy: the destination account copies files itself, nothing passes through this host
+    'SERVER_SIDE_COPY': False,
+    'COPY_WORKERS': 8,
+    # Match uploads against what the destination already holds (by folder, name, md5 and size)
+    'DEST_DEDUP': True,
+    'MIGRATION_WORKERS': 4,  # Users migrated at the same time by the batch runner
+    'SHARED_DRIVE_WORKERS': 4,  # Shared drives of one user transferred at the same time
+    # Migration state store
+    'STATE_COMMIT_BATCH': 500,  # Writes per transaction
+    'STATE_COMMIT_INTERVAL': 2.0,  # Seconds before pending writes are committed anyway
+    # Permission migration
+    'PERMISSION_BATCH_SIZE': 100,  # Items collected before their permissions are migrated
+    'PERMISSION_BATCH_RETRIES': 5,
+    # API rate limiting, per account and endpoint class: (requests per second, concurrent requests).
+    # These are ceilings: the limiters start here and only back off when Google throttles, so
+    # list and media start at the Drive per-user quota of 12,000 requests per minute
+    'RATE_LIMITS': {
+        'list': (200, 32),
+        'media': (200, 32),
+        'export': (5, 4),
+        'write': (10, 8),
+        'permissions': (5, 4),
+        'default': (10, 8)
+    },
+    'MAX_REQUEST_ATTEMPTS': 6,
+    'MAX_BACKOFF': 64,  # Seconds
+    # Dry-run planner estimates
+    'PLAN_THROUGHPUT': {
+        'download': 40 * 1024 * 1024,  # Bytes per second this host sustains from the source
+        'upload': 20 * 1024 * 1024  # Bytes per second to the destination
+    },
+    'PLAN_CALL_LATENCY': 0.3,  # Seconds per API call, bounds calls per second at the concurrency limit
+    'DAILY_UPLOAD_LIMIT': 750 * 1024 ** 3,  # Bytes a destination user may upload per day
+    'PLAN_MAX_AGE': 24 * 3600,  # Seconds a saved plan's listing is reused as crawl input
+    'UI_REFRESH_MS': 250,  # Progress coming from the migration thread is repainted at most this often
+    'METRICS_INTERVAL': 30  # Seconds between metrics snapshots in LOG_DIR, 0 writes only at the end
 }
 
 
 # Create required directories
-for directory in [CONFIG['TOKEN_DIR'], CONFIG['TEMP_DIR'], CONFIG['LOG_DIR'], 'credentials']:
+for directory in [CONFIG['TOKEN_DIR'], CONFIG['TEMP_DIR'], CONFIG['LOG_DIR'], CONFIG['EXPORT_CACHE_DIR'], 'credentials']:
     os.makedirs(directory, exist_ok=True)
@@ -0,0 +1,310 @@
+from googleapiclient.http import MediaIoBaseUpload
+import os
+import logging
+from drive_index import DriveIndex, FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE, inline_permissions
+from server_copy import ServerCopier, CopyBlocked
+from config import CONFIG
+
+
+def token_key(scope):
+    return f'changes_token:{scope}'
+
+
+class DeltaSync:
+    """Catch-up pass that applies source changes since the last full run.
+
+    A full migration stores a changes().getStartPageToken in the state
+    store before it crawls the source. This pass lists only the changes
+    made since that token and, using the source -> destination mapping
+    kept in the state store, creates new items, updates changed content,
+    renames/moves items and trashes what was trashed or deleted. The token
+    only moves forward when every change was applied, so a failed pass is
+    simply run again.
+    """
+
+    FIELDS = f'nextPageToken, newStartPageToken, changes(fileId, removed, file({DriveIndex.FIELDS}, trashed, ownedByMe))'
+
+    def __init__(self, drive_manager, destination_email, source_domain=None, target_domain=None, scope='my_drive'):
+        self.drive_manager = drive_manager
+        self.state = drive_manager.state
+        self.source_domain = source_domain
+        self.target_domain = target_domain
+        self.scope = scope
+        self.copier = ServerCopier(drive_manager, destination_email) if CONFIG['SERVER_SIDE_COPY'] else None
+        self.failures = 0
+
+    def run(self):
+        token = self.state.get_meta(token_key(self.scope))
+        if not token:
+            raise ValueError("No changes token recorded yet, run a full migration first")
+
+        changes, new_token = self._list_changes(token)
+        self.root_id = self.drive_manager._make_request(
+            self.drive_manager.source_service.files().get(fileId='root', fields='id')
+        )['id']
+        logging.info(f"Applying {len(changes)} changed items since the last run")
+
+        folders, files, removed = [], [], []
+        for change in changes.values():
+            item = change.get('file')
+            if change.get('removed') or not item or item.get('trashed'):
+                removed.append(change['fileId'])
+            elif not item.get('ownedByMe', True):
+                continue
+            elif item['mimeType'] == FOLDER_MIME_TYPE:
+                folders.append(item)
+            else:
+                files.append(item)
+
+        self.drive_manager.total_files = len(files)
+        self.drive_manager.current_file_count = 0
+        try:
+            self._apply_folders(folders)
+            for item in files:
+                self._apply(self._apply_file, item)
+            # Trash last, so items moved out of a trashed folder are already safe
+            for source_id in removed:
+                self._apply(self._trash, source_id)
+            self.drive_manager.permission_batcher.flush()
+        finally:
+            self.state.flush()
+
+        if self.failures:
+            logging.warning(f"{self.failures} changes failed, keeping the old changes token so they are retried")
+        else:
+            self.state.set_meta(token_key(self.scope), new_token)
+        return self.failures == 0
+
+    def _list_changes(self, token):
+        """Latest change per file ID since token, and the token for the next pass"""
+        changes = {}
+        while True:
+            response = self.drive_manager._make_request(self.drive_manager.source_service.changes().list(
+                pageToken=token,
+                fields=self.FIELDS,
+                includeRemoved=True,
+                restrictToMyDrive=True,
+                spaces='drive',
+                pageSize=1000
+            ))
+            for change in response.get('changes', []):
+                changes.pop(change['fileId'], None)
+                changes[change['fileId']] = change
+            if 'newStartPageToken' in response:
+                return changes, response['newStartPageToken']
+            token = response['nextPageToken']
+
+    def _apply(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"Error applying change: {str(e)}")
+
+    def _apply_folders(self, folders):
+        """Create or move folders, parents before the folders inside them"""
+        pending = {item['id']: item for item in folders}
+        while pending:
+            ready = [item for item in pending.values() if self._parent_id(item) not in pending]
+            if not ready:
+                # Cycle in the listed parents, nothing sensible to place
+                self.failures += len(pending)
+                logging.error(f"Could not place {len(pending)} changed folders")
+                return
+            for item in ready:
+                del pending[item['id']]
+                self._apply(self._apply_folder, item)
+
+    def _parent_id(self, item):
+        return (item.get('parents') or [None])[0]
+
+    def _dest_parent(self, item):
+        """(rel_path, dest_id) of the folder an item now lives in"""
+        parent_id = self._parent_id(item)
+        if parent_id and parent_id != self.root_id:
+            parent = self.state.item_for_source(self.scope, parent_id)
+            if parent and parent['dest_id']:
+                return parent['rel_path'], parent['dest_id']
+        # Top level, or a parent the full run did not list either
+        return '', 'root'
+
+    def _apply_folder(self, item):
+        parent_path, dest_parent = self._dest_parent(item)
+        name = self.drive_manager._clean_filename(item['name'])
+        rel_path = os.path.join(parent_path, name)
+        existing = self.state.item_for_source(self.scope, item['id'])
+
+        if existing and existing['dest_id']:
+            self._update_metadata(existing['dest_id'], name, dest_parent)
+            if existing['rel_path'] != rel_path:
+                self.state.move_tree(self.scope, existing['rel_path'], rel_path)
+            self.state.record(self.scope, rel_path, phase='uploaded')
+            logging.info(f"Updated folder: {rel_path}")
+            return
+
+        folder = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+            body={'name': name, 'mimeType': FOLDER_MIME_TYPE, 'parents': [dest_parent]},
+            fields='id'
+        ))
+        self.drive_manager._store_file_mapping(
+            self.scope, rel_path, item['id'], folder['id'], mime_type=FOLDER_MIME_TYPE
+        )
+        self._migrate_permissions(item, folder['id'])
+        logging.info(f"Created folder: {rel_path}")
+
+    def _apply_file(self, item):
+        if item['mimeType'] == SHORTCUT_MIME_TYPE:
+            logging.info(f"Skipping shortcut {item['name']}, shortcuts are recreated by a full run")
+            return
+        if (item['mimeType'].startswith('application/vnd.google-apps') and
+                item['mimeType'] not in CONFIG['WORKSPACE_EXPORT_FORMATS']):
+            return
+
+        parent_path, dest_parent = self._dest_parent(item)
+        existing = self.state.item_for_source(self.scope, item['id'])
+
+        if existing and existing['dest_id'] and not self._content_changed(existing, item):
+            name = self._dest_name(item, existing)
+            self._update_metadata(existing['dest_id'], name, dest_parent)
+            dest_id = existing['dest_id']
+            action = "Updated"
+        else:
+            dest_id, name = self._transfer(item, parent_path, dest_parent, existing)
+            action = "Replaced" if existing and existing['dest_id'] else "Created"
+            if not existing or dest_id != existing['dest_id']:
+                # A new destination file (created, or a server side copy replacing the old one) has no sharing yet
+                self._migrate_permissions(item, dest_id)
+
+        rel_path = os.path.join(parent_path, name)
+        if existing and existing['rel_path'] != rel_path:
+            self.state.delete(self.scope, existing['rel_path'])
+        self.drive_manager._store_file_mapping(
+            self.scope, rel_path, item['id'], dest_id,
+            size=item.get('size'),
+            md5_checksum=item.get('md5Checksum'),
+            mime_type=item['mimeType'],
+            source_version=self.drive_manager.source_version(item)
+        )
+        with self.drive_manager.progress_lock:
+            self.drive_manager.current_file_count += 1
+        if hasattr(self.drive_manager, 'ui'):
+            self.drive_manager.ui.update_transfer_info(
+                name,
+                "Syncing",
+                self.drive_manager.current_file_count,
+                self.drive_manager.total_files
+            )
+        logging.info(f"{action}: {rel_path}")
+
+    def _content_changed(self, existing, item):
+        if item.get('md5Checksum'):
+            return item['md5Checksum'] != existing['md5_checksum']
+        # Workspace files have no checksum, compare with the version that was exported.
+        # Rows without one predate the column, export them again to be safe
+        known = existing.get('source_version')
+        return not known or known != self.drive_manager.source_version(item)
+
+    def _dest_name(self, item, existing):
+        """Name the destination copy has, exported Workspace files carry the export extension"""
+        name = self.drive_manager._clean_filename(item['name'])
+        export = CONFIG['WORKSPACE_EXPORT_FORMATS'].get(item['mimeType'])
+        if export and existing['rel_path'].endswith(export[1]):
+            return f"{name}{export[1]}"
+        return name
+
+    def _transfer(self, item, parent_path, dest_parent, existing):
+        """Bring new content over, returns (dest_id, name) of the destination file"""
+        if self.copier and self.copier.can_copy(item):
+            name = self.drive_manager._clean_filename(item['name'])
+            try:
+                dest_id = self.copier.copy(item, name, dest_parent)
+            except CopyBlocked as e:
+                logging.info(f"Server side copy not possible for {item['name']}, transferring through host: {str(e)}")
+            else:
+                if existing and existing['dest_id']:
+                    self._trash_dest(existing['dest_id'])
+                return dest_id, name
+
+        result = self.drive_manager._fetch_file(item, parent_path)
+        if not result:
+            raise ValueError(f"Cannot transfer {item['name']}")
+        file_path, fh = result
+        try:
+            name = os.path.basename(file_path)
+            export = CONFIG['WORKSPACE_EXPORT_FORMATS'].get(item['mimeType'])
+            media = MediaIoBaseUpload(
+                fh,
+                mimetype=export[0] if export else item['mimeType'],
+                chunksize=CONFIG['UPLOAD_CHUNK_SIZE'],
+                resumable=True
+            )
+            files = self.drive_manager.dest_service.files()
+            if existing and existing['dest_id']:
+                request = files.update(
+                    fileId=existing['dest_id'],
+                    body={'name': name, 'trashed': False},
+                    media_body=media,
+                    fields='id',
+                    **self._move_params(existing['dest_id'], dest_parent)
+                )
+            else:
+                request = files.create(
+                    body={'name': name, 'parents': [dest_parent]},
+                    media_body=media,
+                    fields='id'
+                )
+            uploaded = self.drive_manager._resumable_upload(
+                request, self.scope, file_path, self.drive_manager.content_version(item)
+            )
+        finally:
+            fh.close()
+        return uploaded['id'], name
+
+    def _update_metadata(self, dest_id, name, dest_parent):
+        """Rename, move or restore a destination item"""
+        self.drive_manager._retry_upload(self.drive_manager.dest_service.files().update(
+            fileId=dest_id,
+            body={'name': name, 'trashed': False},
+            fields='id',
+            **self._move_params(dest_id, dest_parent)
+        ))
+
+    def _move_params(self, dest_id, dest_parent):
+        current = self.drive_manager._make_request(
+            self.drive_manager.dest_service.files().get(fileId=dest_id, fields='parents'), 'dest'
+        ).get('parents', [])
+        if dest_parent == 'root':
+            # 'root' is an alias, parents are listed by their real ID
+            dest_parent = self._dest_root_id()
+        if dest_parent in current:
+            return {}
+        return {'addParents': dest_parent, 'removeParents': ','.join(current)}
+
+    def _dest_root_id(self):
+        if not hasattr(self, 'dest_root_id'):
+            self.dest_root_id = self.drive_manager._make_request(
+                self.drive_manager.dest_service.files().get(fileId='root', fields='id'), 'dest'
+            )['id']
+        return self.dest_root_id
+
+    def _trash(self, source_id):
+        existing = self.state.item_for_source(self.scope, source_id)
+        if not existing or not existing['dest_id'] or existing['phase'] == 'trashed':
+            return
+        self._trash_dest(existing['dest_id'])
+        self.state.record(self.scope, existing['rel_path'], phase='trashed')
+        logging.info(f"Trashed: {existing['rel_path']}")
+
+    def _trash_dest(self, dest_id):
+        self.drive_manager._retry_upload(self.drive_manager.dest_service.files().update(
+            fileId=dest_id,
+            body={'trashed': True},
+            fields='id'
+        ))
+
+    def _migrate_permissions(self, item, dest_id):
+        if self.source_domain and self.target_domain:
+            self.drive_manager._migrate_sharing_permissions(
+                item['id'], dest_id, self.source_domain, self.target_domain,
+                inline_permissions(item)
+            )
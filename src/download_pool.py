@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import shutil
+import logging
+import threading
+from compression import zip_info_for
+from config import CONFIG
+
+
+class DownloadPool:
+    """Download files on a pool of worker threads into a single ZIP archive.
+
+    Workers fetch file contents in parallel, each through its own Drive
+    service, and hand the finished payloads to one writer thread because
+    zipfile.ZipFile is not safe to write from several threads. Compression
+    also happens on the writer, never on the network threads. Workspace
+    exports get their own CONFIG['EXPORT_WORKERS'] threads, so slow
+    exports never hold up binary downloads.
+    """
+
+    def __init__(self, drive_manager, zip_file, scope, workers=None):
+        self.drive_manager = drive_manager
+        self.zip_file = zip_file
+        self.scope = scope
+        self.workers = workers or CONFIG['DOWNLOAD_WORKERS']
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='download')
+        self.exports = ThreadPoolExecutor(max_workers=CONFIG['EXPORT_WORKERS'], thread_name_prefix='export')
+        # Bounded so workers wait for the writer instead of piling up payloads in memory
+        self.results = queue.Queue(maxsize=self.workers * 2)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def submit(self, item, folder_path):
+        if item['mimeType'] in CONFIG['WORKSPACE_EXPORT_FORMATS']:
+            self.exports.submit(self._fetch, item, folder_path)
+        else:
+            self.executor.submit(self._fetch, item, folder_path)
+
+    def close(self):
+        """Wait for outstanding downloads and flush them to the archive"""
+        self.executor.shutdown(wait=True)
+        self.exports.shutdown(wait=True)
+        self.results.put(None)
+        self.writer.join()
+        self.drive_manager.state.flush()
+
+    def _fetch(self, item, folder_path):
+        try:
+            payload = self.drive_manager._fetch_file(item, folder_path)
+            if payload:
+                self.results.put((item, payload))
+        except Exception as e:
+            logging.error(f"Error downloading {item['name']}: {str(e)}")
+
+    def _write_loop(self):
+        while True:
+            job = self.results.get()
+            if job is None:
+                break
+            item, (file_path, fh) = job
+            try:
+                zinfo = zip_info_for(file_path, item.get('mimeType'))
+                with self.zip_file.open(zinfo, 'w', force_zip64=True) as member:
+                    shutil.copyfileobj(fh, member, CONFIG['DOWNLOAD_CHUNK_SIZE'])
+                self.drive_manager._record_download(item, file_path, self.scope)
+            except Exception as e:
+                logging.error(f"Error writing {file_path} to archive: {str(e)}")
+            finally:
+                fh.close()
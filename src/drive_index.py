@@ -0,0 +1,128 @@
+from collections import defaultdict
+import os
+import logging
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME_TYPE = 'application/vnd.google-apps.shortcut'
+# Listed together with each item so no per-file permissions().list is needed
+PERMISSION_FIELDS = 'permissions(id, emailAddress, role, type, domain), permissionIds'
+
+
+def inline_permissions(item):
+    """Permissions returned with a listed item, or None when they are missing or truncated"""
+    permissions = item.get('permissions')
+    if permissions is None:
+        return None
+    if len(item.get('permissionIds', [])) > len(permissions):
+        return None
+    return permissions
+
+
+class DriveIndex:
+    """In-memory parent/child index of a drive tree.
+
+    Built from a handful of paged drive-wide listings instead of one
+    files().list per folder. Counting, path resolution and job generation
+    all read from here, so the source is only crawled once per run.
+    """
+
+    FIELDS = f'id, name, mimeType, parents, size, quotaBytesUsed, md5Checksum, modifiedTime, version, shortcutDetails, {PERMISSION_FIELDS}'
+
+    def __init__(self, root_id, clean_name):
+        self.root_id = root_id
+        self.clean_name = clean_name
+        self.items = {}
+        self.children = defaultdict(list)
+        self.by_name = {}
+
+    @classmethod
+    def crawl(cls, drive_manager, service, query="'me' in owners and trashed=false", root_id=None,
+              account='source', **list_kwargs):
+        """Page through a drive-wide query and rebuild the tree locally"""
+        if root_id is None:
+            root_id = drive_manager._make_request(
+                service.files().get(fileId='root', fields='id'), account
+            )['id']
+
+        items = drive_manager._list_files(
+            service,
+            account,
+            q=query,
+            fields=f"nextPageToken, files({cls.FIELDS})",
+            **list_kwargs
+        )
+        return cls.from_items(root_id, drive_manager._clean_filename, items)
+
+    @classmethod
+    def crawl_shared_drive(cls, drive_manager, service, drive_id):
+        """Page through everything in one shared drive with a drive-wide corpora listing"""
+        return cls.crawl(
+            drive_manager, service, query='trashed=false', root_id=drive_id,
+            corpora='drive', driveId=drive_id, includeItemsFromAllDrives=True, supportsAllDrives=True
+        )
+
+    @classmethod
+    def from_items(cls, root_id, clean_name, items):
+        """Build the tree from already listed items, e.g. the ones saved with a migration plan"""
+        index = cls(root_id, clean_name)
+        for item in items:
+            index.items[item['id']] = item
+
+        orphans = 0
+        for item in index.items.values():
+            parent_id = (item.get('parents') or [None])[0]
+            if parent_id != root_id and parent_id not in index.items:
+                # Parent is not ours to list (or there is none), keep the item at the top level
+                parent_id = root_id
+                orphans += 1
+            index.children[parent_id].append(item)
+            # First item wins when a folder holds several with the same name
+            index.by_name.setdefault(
+                (parent_id, index.clean_name(item['name']), item['mimeType'] == FOLDER_MIME_TYPE), item
+            )
+
+        logging.info(f"Indexed {len(index.items)} items ({orphans} without a listed parent)")
+        return index
+
+    def walk(self, folder_id=None, folder_path=''):
+        """Yield (item, folder_path) for everything below a folder, parents first"""
+        stack = [(folder_id or self.root_id, folder_path)]
+        while stack:
+            current_id, current_path = stack.pop()
+            for item in self.children.get(current_id, []):
+                yield item, current_path
+                if item['mimeType'] == FOLDER_MIME_TYPE:
+                    stack.append((item['id'], os.path.join(current_path, self.clean_name(item['name']))))
+
+    def find(self, parent_id, name, folder=False):
+        """Item called name (compared cleaned) directly inside parent_id, or None"""
+        if parent_id == 'root':
+            parent_id = self.root_id
+        return self.by_name.get((parent_id, name, folder))
+
+    def find_path(self, path, folder=False):
+        """Item at a cleaned path relative to the root, or None"""
+        parts = [part for part in path.split(os.sep) if part]
+        parent_id = self.root_id
+        for part in parts[:-1]:
+            parent = self.by_name.get((parent_id, part, True))
+            if not parent:
+                return None
+            parent_id = parent['id']
+        return self.by_name.get((parent_id, parts[-1], folder)) if parts else None
+
+    def count_files(self, folder_id=None):
+        return sum(
+            1 for item, _ in self.walk(folder_id)
+            if item['mimeType'] != FOLDER_MIME_TYPE
+        )
+
+    def path_of(self, item_id):
+        """Relative path of an item from the index root"""
+        parts = []
+        item = self.items.get(item_id)
+        while item is not None:
+            parts.append(self.clean_name(item['name']))
+            parent_id = (item.get('parents') or [None])[0]
+            item = self.items.get(parent_id)
+        return os.path.join(*reversed(parts)) if parts else ''
@@ -1,74 +1,102 @@
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
-from socket import timeout as SocketTimeout
+from googleapiclient.http import MediaIoBaseDownload
 import sys
-import ssl
 import os
-import io
+import tempfile
+import shutil
+import time
 import zipfile
-import json
 import logging
-import socket
 import googleapiclient.errors
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from auth_manager import AuthManager
+from transport import Transport
+from stream_transfer import StreamTransfer
+from download_pool import DownloadPool
+from drive_index import DriveIndex, FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE, PERMISSION_FIELDS, inline_permissions
+from upload_scheduler import UploadScheduler
+from state_store import StateStore
+from permission_batcher import PermissionBatcher
+from delta_sync import DeltaSync, token_key
+from planner import MigrationPlanner, load_index
+from shared_drives import SharedDriveMigrator
+from export_cache import ExportCache
+from ranged_download import download_ranges, use_ranged_download
+from request_executor import RequestExecutor
+from metrics import Metrics
 from config import CONFIG
 
 class DriveManager:
-    def __init__(self):
-        self.source_service = AuthManager.get_drive_service(
-            CONFIG['SOURCE_CREDENTIALS_FILE'],
-            os.path.join(CONFIG['TOKEN_DIR'], 'source_token.pickle')
-        )
-        self.dest_service = AuthManager.get_drive_service(
-            CONFIG['DEST_CREDENTIALS_FILE'],
-            os.path.join(CONFIG['TOKEN_DIR'], 'dest_token.pickle')
-        )
+    def __init__(self, user=None, service_factory=None):
+        # A named user gets its own tokens, staging directory, state and log, so users can run side by side
+        self.user = user
+        self.work_dir = os.path.join(CONFIG['TEMP_DIR'], user) if user else CONFIG['TEMP_DIR']
+        os.makedirs(self.work_dir, exist_ok=True)
+        # service_factory(account) stands in for the Google API services, e.g. fake_drive in benchmarks
+        self.service_factory = service_factory
+        self.timeout = 300  # 5 minutes timeout
+        self.transports = {}
+        if service_factory is None:
+            self.source_creds = AuthManager.get_credentials(
+                CONFIG['SOURCE_CREDENTIALS_FILE'],
+                AuthManager.token_file('source', user)
+            )
+            self.dest_creds = AuthManager.get_credentials(
+                CONFIG['DEST_CREDENTIALS_FILE'],
+                AuthManager.token_file('dest', user)
+            )
+            self.transports = {
+                'source': Transport(self.source_creds, self.timeout),
+                'dest': Transport(self.dest_creds, self.timeout)
+            }
+        # Service objects are not thread-safe, each thread builds its own once and keeps it
+        self._services = threading.local()
         self.setup_logging()
-        self.retry_count = 0
-        self.max_retries = 5
+        self.metrics = Metrics(user or 'migration')
+        self.metrics.start()
+        self.requests = RequestExecutor(self.metrics)
         self.current_file_count = 0
         self.total_files = 0
-        self.metadata = {}
-        self.metadata_path = os.path.join(CONFIG['TEMP_DIR'], 'file_metadata.json')
-        self._init_metadata()
-        self.timeout = 300  # 5 minutes timeout
-        ssl._create_default_https_context = ssl._create_unverified_context
-
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=2, min=4, max=60),
-        reraise=True
-    )
-    def _make_request(self, request):
-        try:
-            return request.execute(num_retries=5)
-        except Exception as e:
-            logging.warning(f"Request failed, retrying... {str(e)}")
-            raise
+        # Every transfer thread, across drives, counts progress under this one lock
+        self.progress_lock = threading.Lock()
+        self.index = None
+        self.dest_index = None
+        self.state = StateStore(os.path.join(self.work_dir, 'migration_state.db'))
+        self.permission_batcher = PermissionBatcher(self)
+        self.export_cache = ExportCache(self)
+        # Range segments of every large file share one pool, its threads keep their services between files
+        self.segment_pool = ThreadPoolExecutor(
+            max_workers=CONFIG['RANGED_DOWNLOAD_SEGMENTS'], thread_name_prefix='segment'
+        )
 
+    @property
+    def source_service(self):
+        if not hasattr(self._services, 'source'):
+            self._services.source = self._build_service('source')
+        return self._services.source
 
-    def _init_metadata(self):
-        """Initialize metadata storage"""
-        os.makedirs(CONFIG['TEMP_DIR'], exist_ok=True)
-        
-        try:
-            with open(self.metadata_path, 'r') as f:
-                self.metadata = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.metadata = {}
-            with open(self.metadata_path, 'w') as f:
-                json.dump(self.metadata, f)
-
-    def _save_metadata(self):
-        """Save current metadata to file"""
-        with open(self.metadata_path, 'w') as f:
-            json.dump(self.metadata, f)
+    @property
+    def dest_service(self):
+        if not hasattr(self._services, 'dest'):
+            self._services.dest = self._build_service('dest')
+        return self._services.dest
+
+    def _build_service(self, account):
+        if self.service_factory:
+            return self.service_factory(account)
+        return self.transports[account].build_service()
+
+    def _make_request(self, request, account='source', endpoint='list'):
+        """Execute a Drive request through the shared rate limiter and retry policy"""
+        return self.requests.execute(request, account, endpoint)
 
     def setup_logging(self):
+        prefix = f'migration_{self.user}' if self.user else 'migration'
         log_file = os.path.join(
             CONFIG['LOG_DIR'], 
-            f'migration_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
+            f'{prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log'
         )
         logging.basicConfig(
             level=logging.INFO,
@@ -76,194 +104,251 @@ class DriveManager:
             handlers=[
                 logging.FileHandler(log_file, encoding='utf-8'),
                 logging.StreamHandler(sys.stdout)
-            ]
+            ],
+            # Batch worker processes migrate one user after another, each into its own log
+            force=True
         )
 
     def set_ui(self, ui):
         self.ui = ui
 
+    def close(self):
+        """End of run: stop the segment pool, write the final metrics, log their summary and close the state store"""
+        self.segment_pool.shutdown(wait=True)
+        self.metrics.close()
+        self.state.close()
+
+    def _list_files(self, service, account='source', **kwargs):
+        """Yield every item of a files().list query, following nextPageToken"""
+        kwargs.setdefault('pageSize', 1000)
+        page_token = None
+        while True:
+            results = self._make_request(service.files().list(pageToken=page_token, **kwargs), account)
+            for item in results.get('files', []):
+                yield item
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+    def build_index(self):
+        """Crawl the source My Drive once and keep the tree in memory, or take it from a fresh saved plan"""
+        with self.metrics.phase('crawl') as phase:
+            self.index = load_index(self, 'my_drive') or DriveIndex.crawl(self, self.source_service)
+            phase['items'] = len(self.index.items)
+        return self.index
+
+    def build_shared_drive_index(self, drive_id):
+        """Crawl one shared drive, or take its listing from a fresh saved plan"""
+        with self.metrics.phase('crawl') as phase:
+            index = (load_index(self, f"shared_drive:{drive_id}") or
+                     DriveIndex.crawl_shared_drive(self, self.source_service, drive_id))
+            phase['items'] = len(index.items)
+        return index
+
+    def build_dest_index(self):
+        """Crawl the destination My Drive so content it already holds is not sent again"""
+        self.dest_index = None
+        if CONFIG['DEST_DEDUP']:
+            with self.metrics.phase('crawl') as phase:
+                self.dest_index = DriveIndex.crawl(self, self.dest_service, account='dest')
+                phase['items'] = len(self.dest_index.items)
+        return self.dest_index
+
     def count_total_files(self, folder_id='root'):
         try:
-            count = 0
-            results = self.source_service.files().list(
-                q=f"'{folder_id}' in parents and trashed=false",
-                fields="files(id, mimeType)"
-            ).execute()
-            
-            for item in results.get('files', []):
-                if item['mimeType'] == 'application/vnd.google-apps.folder':
-                    count += self.count_total_files(item['id'])
-                else:
-                    count += 1
-            
-            return count
+            if self.index is None:
+                self.build_index()
+            return self.index.count_files(None if folder_id == 'root' else folder_id)
         except Exception as e:
             logging.error(f"Error counting files: {str(e)}")
             return 0
 
+    def plan_migration(self, user_email, source_domain=None, target_domain=None,
+                       shared_drives=True, shared_with_me=True):
+        """Dry run: list every source and estimate the migration, nothing is transferred"""
+        logging.info(f"Planning migration for {user_email}")
+        self.source_email = user_email
+        # Recorded before the plan's crawl, so a run indexing from the plan still catches later changes
+        self._record_changes_token()
+        plan = MigrationPlanner(self, source_domain, target_domain).run(user_email, shared_drives, shared_with_me)
+        self.total_files = sum(source['totals']['files'] for source in plan['sources'].values())
+        return plan
+
     def download_drive(self, user_email):
         # Check existing download
         existing_zip = self.check_existing_download(user_email)
         if existing_zip:
             return existing_zip
 
-        # Check last log for completed download
-        log_files = sorted([f for f in os.listdir(CONFIG['LOG_DIR']) if f.endswith('.log')], reverse=True)
-        
-        if log_files:
-            with open(os.path.join(CONFIG['LOG_DIR'], log_files[0]), 'r', encoding='utf-8', errors='replace') as log:
-                last_log = log.read()
-                completion_message = f"Download completed for {user_email}"
-                if completion_message in last_log:
-                    logging.info(f"Previous download detected for {user_email}, skipping download process")
-                    zip_path = os.path.join(CONFIG['TEMP_DIR'], f"{user_email}_drive.zip")
-                    if os.path.exists(zip_path):
-                        return zip_path
-
-        # Proceed with normal download if no matching completed download found
+        # Proceed with normal download if no completed download was checkpointed
         logging.info(f"Starting download for {user_email}")
-        self.total_files = self.count_total_files()
+        self.source_email = user_email
+        self._record_changes_token()
+        self.build_index()
+        self.total_files = self.index.count_files()
         self.current_file_count = 0
         
-        zip_path = os.path.join(CONFIG['TEMP_DIR'], f"{user_email}_drive.zip")
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            self._download_folder('root', '', zip_file)
-                
+        zip_path = os.path.join(self.work_dir, f"{user_email}_drive.zip")
+        self._download_index(self.index, zip_path, 'my_drive')
         logging.info(f"Download completed for {user_email}")
         return zip_path
 
-    def download_shared_drive(self, user_email):
-        """Download Shared Drive contents"""
-        logging.info(f"Starting Shared Drive download for {user_email}")
-        
-        # Get list of shared drives
-        shared_drives = self.source_service.drives().list(fields="drives(id, name)").execute()
+    def _download_index(self, index, zip_path, scope):
+        """Download every file of an indexed tree into a staging archive"""
+        self.state.record_checkpoint(scope, 'download', 'running', archive_path=zip_path)
         
-        for drive in shared_drives.get('drives', []):
-            try:
-                zip_path = os.path.join(CONFIG['TEMP_DIR'], f"shared_drive_{drive['name']}.zip")
-                with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    self._download_folder(drive['id'], '', zip_file, is_shared_drive=True)
-                logging.info(f"Downloaded shared drive: {drive['name']}")
-                return zip_path
-            except Exception as e:
-                logging.error(f"Error downloading shared drive {drive['name']}: {str(e)}")
-                raise
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            with DownloadPool(self, zip_file, scope) as pool:
+                for item, folder_path in index.walk():
+                    if item['mimeType'] == FOLDER_MIME_TYPE:
+                        # Folders are not archived but uploads need their source IDs
+                        self.state.record(
+                            scope,
+                            os.path.join(folder_path, self._clean_filename(item['name'])),
+                            source_id=item['id'],
+                            mime_type=FOLDER_MIME_TYPE,
+                            permissions=inline_permissions(item)
+                        )
+                        continue
+                    try:
+                        self._download_file(item, folder_path, pool)
+                    except Exception as e:
+                        logging.error(f"Error downloading {item['name']}: {str(e)}")
+                
+        self.state.record_checkpoint(scope, 'download', 'complete', self.current_file_count, zip_path)
+
+    def stream_drive(self, source_email, destination_email, source_domain=None, target_domain=None):
+        """Transfer My Drive straight to the destination without ZIP staging"""
+        logging.info(f"Starting direct transfer from {source_email} to {destination_email}")
+        self.source_email = source_email
+        self._record_changes_token()
+        self.build_index()
+        self.build_dest_index()
+        self.total_files = self.index.count_files()
+        self.current_file_count = 0
+
+        self.state.record_checkpoint('my_drive', 'stream', 'running')
+        try:
+            StreamTransfer(self, destination_email, source_domain, target_domain).run(self.index)
+            self.permission_batcher.flush()
+        finally:
+            self.state.flush()
+        self.state.record_checkpoint('my_drive', 'stream', 'complete', self.current_file_count)
+
+        logging.info(f"Direct transfer completed for {source_email}")
+        return True
+
+    def _record_changes_token(self, scope='my_drive'):
+        """Remember where the changes feed stood before the first full run, for later delta passes"""
+        if self.state.get_meta(token_key(scope)):
+            return
+        token = self._make_request(self.source_service.changes().getStartPageToken())['startPageToken']
+        self.state.set_meta(token_key(scope), token)
+        logging.info(f"Recorded changes start token {token} for {scope}")
+
+    def sync_changes(self, source_email, destination_email, source_domain=None, target_domain=None):
+        """Apply only what changed in My Drive since the last full migration"""
+        logging.info(f"Starting delta sync from {source_email} to {destination_email}")
+        self.source_email = source_email
+        result = DeltaSync(self, destination_email, source_domain, target_domain).run()
+        logging.info(f"Delta sync completed for {source_email}")
+        return result
+
+    def migrate_shared_drives(self, source_email, destination_email, source_domain=None, target_domain=None):
+        """Transfer every shared drive, several at once, each into its own destination shared drive"""
+        logging.info(f"Starting shared drive migration from {source_email} to {destination_email}")
+        self.source_email = source_email
+        failed = SharedDriveMigrator(self, destination_email, source_domain, target_domain).run()
+        logging.info(f"Shared drive migration finished for {source_email}, {len(failed)} drives failed")
+        return failed
     
     def download_shared_with_me(self, user_email):
         """Download files shared with the user that are owned by source"""
+        existing_zip = self.completed_archive('shared_with_me')
+        if existing_zip:
+            logging.info(f"Found existing download of shared files for {user_email}")
+            return existing_zip
+
         logging.info(f"Starting Shared with me download for {user_email}")
-        zip_path = os.path.join(CONFIG['TEMP_DIR'], f"{user_email}_shared.zip")
+        zip_path = os.path.join(self.work_dir, f"{user_email}_shared.zip")
+        self.state.record_checkpoint('shared_with_me', 'download', 'running', archive_path=zip_path)
         
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            results = self._make_request(
-                self.source_service.files().list(
+            with DownloadPool(self, zip_file, 'shared_with_me') as pool:
+                items = self._list_files(
+                    self.source_service,
                     q="sharedWithMe=true and trashed=false",
-                    fields="files(id, name, mimeType, parents, owners)",
-                    pageSize=1000
+                    fields=f"nextPageToken, files(id, name, mimeType, parents, owners, modifiedTime, version, {PERMISSION_FIELDS})"
                 )
-            )
             
-            for item in results.get('files', []):
-                # Check if the file is owned by source user
-                if item['owners'][0]['emailAddress'] == user_email:
-                    self._handle_shared_item(item, zip_file)
+                for item in items:
+                    # Check if the file is owned by source user
+                    if item['owners'][0]['emailAddress'] == user_email:
+                        self._handle_shared_item(item, pool)
                 
+        self.state.record_checkpoint('shared_with_me', 'download', 'complete', self.current_file_count, zip_path)
         logging.info(f"Completed downloading shared files for {user_email}")
         return zip_path
 
-    def _handle_shared_item(self, item, zip_file):
+    def _handle_shared_item(self, item, pool):
         """Process individual shared items"""
         try:
             if item['mimeType'] == 'application/vnd.google-apps.folder':
-                self._download_folder(item['id'], item['name'], zip_file)
+                self._download_folder(item['id'], item['name'], pool)
             else:
-                self._download_file(item, '', zip_file)
+                self._download_file(item, '', pool)
         except Exception as e:
             logging.error(f"Error handling shared item {item['name']}: {str(e)}")
 
-    def _handle_shortcut(self, item, folder_path, zip_file):
+    def _handle_shortcut(self, item, folder_path, pool):
         """Handle Google Drive shortcuts and owned files within shortcut folders"""
         try:
             target_id = item['shortcutDetails']['targetId']
             
             # Get target folder contents if it's a folder
-            results = self.source_service.files().list(
+            results = self._list_files(
+                self.source_service,
                 q=f"'{target_id}' in parents and trashed=false",
-                fields="files(id, name, mimeType, owners)",
-                pageSize=1000
-            ).execute()
+                fields=f"nextPageToken, files(id, name, mimeType, owners, modifiedTime, version, {PERMISSION_FIELDS})"
+            )
             
-            # Store shortcut mapping for recreation
-            shortcut_info = {
-                'sourceId': item['id'],
-                'targetId': target_id,
-                'path': folder_path,
-                'name': item['name']
-            }
-            if not hasattr(self, 'shortcuts'):
-                self.shortcuts = []
-            self.shortcuts.append(shortcut_info)
+            # Kept in the state store, the upload phase recreates it once the folders exist
+            self.state.record(
+                pool.scope,
+                os.path.join(folder_path, self._clean_filename(item['name'])),
+                source_id=item['id'],
+                mime_type=SHORTCUT_MIME_TYPE,
+                target_id=target_id,
+                phase='downloaded'
+            )
             
             # Process files in shortcut folder
-            for file in results.get('files', []):
+            for file in results:
                 if file['owners'][0]['emailAddress'] == self.source_email:
                     if file['mimeType'] == 'application/vnd.google-apps.folder':
                         new_path = os.path.join(folder_path, self._clean_filename(file['name']))
-                        self._download_folder(file['id'], new_path, zip_file)
+                        self._download_folder(file['id'], new_path, pool)
                     else:
-                        self._download_file(file, folder_path, zip_file)
+                        self._download_file(file, folder_path, pool)
                         
         except Exception as e:
             logging.error(f"Error processing shortcut folder contents: {str(e)}")
 
-    def _recreate_shortcuts(self, dest_email):
-        """Recreate shortcuts in destination drive"""
-        for shortcut in self.shortcuts:
-            try:
-                shortcut_metadata = {
-                    'name': shortcut['name'],
-                    'mimeType': 'application/vnd.google-apps.shortcut',
-                    'shortcutDetails': {
-                        'targetId': shortcut['targetId']
-                    },
-                    'parents': [self._get_or_create_folder(shortcut['path'], dest_email)]
-                }
-                
-                self.dest_service.files().create(
-                    body=shortcut_metadata,
-                    fields='id'
-                ).execute()
-                
-                logging.info(f"Recreated shortcut: {shortcut['name']}")
-                
-            except Exception as e:
-                logging.error(f"Error recreating shortcut {shortcut['name']}: {str(e)}")
-
-    def _download_folder(self, folder_id, folder_path, zip_file):
+    def _download_folder(self, folder_id, folder_path, pool):
         try:
-            results = self.source_service.files().list(
+            items = self._list_files(
+                self.source_service,
                 q=f"'{folder_id}' in parents and trashed=false",
-                fields="files(id, name, mimeType)",
-                pageSize=1000
-            ).execute()
+                fields=f"nextPageToken, files(id, name, mimeType, shortcutDetails, modifiedTime, version, {PERMISSION_FIELDS})"
+            )
 
-            for item in results.get('files', []):
+            for item in items:
                 try:
-                    if item['mimeType'] == 'application/vnd.google-apps.folder':
+                    if item['mimeType'] == FOLDER_MIME_TYPE:
                         new_path = os.path.join(folder_path, self._clean_filename(item['name']))
-                        self._download_folder(item['id'], new_path, zip_file)
+                        self._download_folder(item['id'], new_path, pool)
                     else:
-                        self._download_file(item, folder_path, zip_file)
-                        self.current_file_count += 1
-                        if hasattr(self, 'ui'):
-                            self.ui.update_transfer_info(
-                                item['name'],
-                                "Downloading",
-                                self.current_file_count,
-                                self.total_files
-                            )
+                        self._download_file(item, folder_path, pool)
                 except Exception as e:
                     logging.error(f"Error downloading {item['name']}: {str(e)}")
                     continue
@@ -272,62 +357,97 @@ class DriveManager:
             logging.error(f"Error downloading folder {folder_id}: {str(e)}")
             raise
 
-    def _download_file(self, item, folder_path, zip_file):
+    def _download_file(self, item, folder_path, pool):
         try:
             # Add shortcut handling at the start
-            if item['mimeType'] == 'application/vnd.google-apps.shortcut':
-                self._handle_shortcut(item, folder_path, zip_file)
+            if item['mimeType'] == SHORTCUT_MIME_TYPE:
+                self._handle_shortcut(item, folder_path, pool)
                 return
-            # Existing workspace file handling    
-            elif item['mimeType'].startswith('application/vnd.google-apps'):
-                self._handle_workspace_file(item, folder_path, zip_file)
-            else:
-                request = self.source_service.files().get_media(fileId=item['id'])
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    _, done = downloader.next_chunk()
-
-                file_path = os.path.join(folder_path, self._clean_filename(item['name']))
-                self.metadata[file_path] = item['id']
-                self._save_metadata()
-
-                zip_file.writestr(file_path, fh.getvalue())
-                logging.info(f"Downloaded: {item['name']}")
+            pool.submit(item, folder_path)
         except Exception as e:
             logging.error(f"Error downloading file {item['name']}: {str(e)}")
             raise
 
-    def _handle_workspace_file(self, item, folder_path, zip_file):
-        workspace_formats = {
-            'application/vnd.google-apps.document': ('application/vnd.openxmlformats-officedocument.wordprocessingml.document', '.docx'),
-            'application/vnd.google-apps.spreadsheet': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
-            'application/vnd.google-apps.presentation': ('application/vnd.openxmlformats-officedocument.presentationml.presentation', '.pptx'),
-            'application/vnd.google-apps.drawing': ('application/pdf', '.pdf'),
-            'application/vnd.google-apps.script': ('application/json', '.json'),
-            'application/vnd.google-apps.form': ('application/pdf', '.pdf')
-        }
+    def _fetch_file(self, item, folder_path):
+        """Download file contents on a pool worker, returns (archive path, buffer)"""
+        if item['mimeType'].startswith('application/vnd.google-apps'):
+            return self._handle_workspace_file(item, folder_path)
+
+        fh = self._download_media(item)
+
+        file_path = os.path.join(folder_path, self._clean_filename(item['name']))
+        logging.info(f"Downloaded: {item['name']}")
+        return file_path, fh
+
+    def _download_media(self, item):
+        """Download a binary file, large ones as parallel ranged segments"""
+        if use_ranged_download(item):
+            return download_ranges(self, item)
+        return self._download_to_spool(self.source_service.files().get_media(fileId=item['id'], supportsAllDrives=True))
+
+    def _download_to_spool(self, request, account='source', phase='download', endpoint='media'):
+        """Download a media request chunk by chunk into a spooled temp file.
+
+        Only CONFIG['SPOOL_MAX_MEMORY'] bytes are kept in memory, anything
+        larger is spilled to the work directory, so memory use does not grow with the
+        file size. The returned file is rewound and must be closed by the caller.
+        """
+        fh = tempfile.SpooledTemporaryFile(
+            max_size=CONFIG['SPOOL_MAX_MEMORY'],
+            dir=self.work_dir
+        )
+        try:
+            with self.metrics.phase(phase) as timing:
+                downloader = MediaIoBaseDownload(fh, request, chunksize=CONFIG['DOWNLOAD_CHUNK_SIZE'])
+                done = False
+                while not done:
+                    _, done = self.requests.call(downloader.next_chunk, account, endpoint)
+                timing['bytes'] = fh.tell()
+            fh.seek(0)
+        except Exception:
+            fh.close()
+            raise
+        return fh
+
+    def _record_download(self, item, file_path, scope):
+        """Book-keeping for a file written to the archive, runs on the writer thread"""
+        self.state.record(
+            scope,
+            file_path,
+            source_id=item['id'],
+            size=item.get('size'),
+            md5_checksum=item.get('md5Checksum'),
+            mime_type=item['mimeType'],
+            source_version=self.source_version(item),
+            phase='downloaded',
+            permissions=inline_permissions(item)
+        )
+        with self.progress_lock:
+            self.current_file_count += 1
+        if hasattr(self, 'ui'):
+            self.ui.update_transfer_info(
+                item['name'],
+                "Downloading",
+                self.current_file_count,
+                self.total_files
+            )
+
+    def _handle_workspace_file(self, item, folder_path):
+        workspace_formats = CONFIG['WORKSPACE_EXPORT_FORMATS']
 
         if item['mimeType'] in workspace_formats:
             export_mime, extension = workspace_formats[item['mimeType']]
-            request = self.source_service.files().export_media(
-                fileId=item['id'],
-                mimeType=export_mime
-            )
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            while not done:
-                _, done = downloader.next_chunk()
+            fh = self.export_cache.export(item, export_mime)
 
             file_path = os.path.join(folder_path, f"{self._clean_filename(item['name'])}{extension}")
-            zip_file.writestr(file_path, fh.getvalue())
             logging.info(f"Exported: {item['name']}")
+            return file_path, fh
+        return None
 
     def extract_drive(self, zip_path):
         logging.info(f"Starting extraction of {zip_path}")
-        extract_path = os.path.join(CONFIG['TEMP_DIR'], 'extracted')
+        # One directory per archive, so My Drive and shared files never mix
+        extract_path = os.path.join(self.work_dir, 'extracted', os.path.splitext(os.path.basename(zip_path))[0])
         
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             for file_info in zip_ref.infolist():
@@ -336,7 +456,9 @@ class DriveManager:
                     # Create parent directories if they don't exist
                     os.makedirs(os.path.dirname(target_path), exist_ok=True)
                     # Extract the file
-                    zip_ref.extract(file_info, extract_path)
+                    with self.metrics.phase('extract') as phase:
+                        zip_ref.extract(file_info, extract_path)
+                        phase['bytes'] = file_info.file_size
                     logging.info(f"Extracted: {file_info.filename}")
                 except Exception as e:
                     logging.error(f"Error extracting {file_info.filename}: {str(e)}")
@@ -345,278 +467,231 @@ class DriveManager:
         logging.info("Extraction completed")
         return extract_path
 
+    def cleanup_staging(self):
+        """Remove staged archives and extracted files, the state store is kept for later runs"""
+        for name in os.listdir(self.work_dir):
+            path = os.path.join(self.work_dir, name)
+            if name == 'extracted' and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif name.endswith('.zip'):
+                os.remove(path)
+
     def check_existing_download(self, user_email):
-        """Check if download already exists for the user"""
-        zip_path = os.path.join(CONFIG['TEMP_DIR'], f"{user_email}_drive.zip")
-        if os.path.exists(zip_path):
+        """Check if a finished download of the user's My Drive can be reused"""
+        zip_path = self.completed_archive('my_drive')
+        if zip_path:
             logging.info(f"Found existing download for {user_email}")
-            return zip_path
+        return zip_path
+
+    def completed_archive(self, scope):
+        """Archive of a download of scope checkpointed as complete that still exists, or None"""
+        checkpoint = self.state.checkpoint(scope, 'download')
+        if checkpoint and checkpoint['status'] == 'complete' and checkpoint['archive_path']:
+            if os.path.exists(checkpoint['archive_path']):
+                return checkpoint['archive_path']
         return None
     
-    def upload_drive(self, extract_path, destination_email, source_domain, target_domain):
+    def upload_drive(self, extract_path, destination_email, source_domain, target_domain,
+                     scope='my_drive', parent_id='root'):
+        """Upload an extracted archive of scope below parent_id, My Drive root by default"""
         logging.info(f"Starting upload process to {destination_email}")
         try:
-            resume_file = os.path.join(CONFIG['TEMP_DIR'], f'resume_{destination_email}.txt')
-            uploaded_files = set()
-            
-            if os.path.exists(resume_file):
-                try:
-                    with open(resume_file, 'r', encoding='utf-8', errors='replace') as f:
-                        uploaded_files = set(f.read().splitlines())
-                except Exception as e:
-                    logging.warning(f"Resume file read error, starting fresh: {str(e)}")
-                    uploaded_files = set()
-
             # Count total files for upload
             self.total_files = sum([len(files) for _, _, files in os.walk(extract_path)])
-            self.current_file_count = len(uploaded_files)
+            self.current_file_count = self.state.count_files(scope, 'uploaded')
+            self.build_dest_index()
+            self.state.record_checkpoint(scope, 'upload', 'running')
 
-            result = self._upload_folder(extract_path, 'root', uploaded_files, resume_file, source_domain, target_domain)
+            result = self._upload_folder(extract_path, parent_id, scope, source_domain, target_domain)
+            self.state.record_checkpoint(scope, 'upload', 'complete', self.current_file_count)
             return result
         except Exception as e:
             logging.error(f"Upload failed: {str(e)}")
             raise
         
     def list_shared_drives(self, user_email):
-        """Get list of shared drives"""
-        try:
-            results = self.source_service.drives().list(fields="drives(id, name)").execute()
-            drives = results.get('drives', [])
-            if drives:
-                logging.info(f"Found {len(drives)} shared drives")
-            return drives
-        except Exception as e:
-            logging.error(f"Error listing shared drives: {str(e)}")
-            return []
+        """Get every shared drive of the source user, following nextPageToken.
 
-    def upload_shared_drive(self, extract_path, destination_email):
-        """Upload shared drive content to destination"""
-        logging.info(f"Starting shared drive upload to {destination_email}")
+        A failed listing raises: an empty list would read as "no shared
+        drives" and the run would report success without migrating any.
+        """
         try:
-            # Create new shared drive in destination
-            drive_metadata = {
-                'name': f"Migrated Shared Drive - {datetime.now().strftime('%Y%m%d')}"
-            }
-            new_drive = self.dest_service.drives().create(body=drive_metadata).execute()
-            
-            # Upload content to new shared drive
-            self._upload_folder(extract_path, new_drive['id'], set(), 
-                os.path.join(CONFIG['TEMP_DIR'], f'resume_shared_{destination_email}.txt'))
-                
-            logging.info("Shared drive upload completed")
-            return new_drive['id']
+            drives = []
+            page_token = None
+            while True:
+                results = self._make_request(self.source_service.drives().list(
+                    pageSize=100,
+                    pageToken=page_token,
+                    fields="nextPageToken, drives(id, name)"
+                ))
+                drives.extend(results.get('drives', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
         except Exception as e:
-            logging.error(f"Shared drive upload failed: {str(e)}")
+            logging.error(f"Error listing shared drives: {str(e)}")
             raise
-
-    def upload_shared_with_me(self, extract_path, destination_email):
-        """Upload shared files to destination"""
+        logging.info(f"Found {len(drives)} shared drives")
+        return drives
+
+    def create_shared_drive(self, name):
+        """Create a shared drive in the destination, returns its ID"""
+        new_drive = self._retry_upload(self.dest_service.drives().create(
+            body={'name': name},
+            # Required by drives().create, a retried request with the same ID cannot create a second drive
+            requestId=str(uuid.uuid4()),
+            fields='id'
+        ))
+        logging.info(f"Created destination shared drive: {name}")
+        return new_drive['id']
+
+    def upload_shared_with_me(self, extract_path, destination_email, source_domain=None, target_domain=None):
+        """Upload shared files into their own destination folder, kept apart from My Drive"""
         logging.info(f"Starting shared files upload to {destination_email}")
         try:
-            # Create shared folder in destination
-            folder_metadata = {
-                'name': f"Migrated Shared Files - {datetime.now().strftime('%Y%m%d')}",
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            shared_folder = self.dest_service.files().create(
-                body=folder_metadata,
-                fields='id'
-            ).execute()
+            # The folder of an earlier run is reused, so resumed uploads land in the same place
+            folder_id = self.state.get_meta('shared_with_me_dest_folder')
+            if not folder_id:
+                folder_metadata = {
+                    'name': f"Migrated Shared Files - {datetime.now().strftime('%Y%m%d')}",
+                    'mimeType': 'application/vnd.google-apps.folder'
+                }
+                folder_id = self._retry_upload(self.dest_service.files().create(
+                    body=folder_metadata,
+                    fields='id'
+                ))['id']
+                self.state.set_meta('shared_with_me_dest_folder', folder_id)
             
             # Upload shared content
-            self._upload_folder(extract_path, shared_folder['id'], set(),
-                os.path.join(CONFIG['TEMP_DIR'], f'resume_shared_files_{destination_email}.txt'))
+            self.upload_drive(
+                extract_path, destination_email, source_domain, target_domain,
+                scope='shared_with_me', parent_id=folder_id
+            )
                 
             logging.info("Shared files upload completed")
-            return shared_folder['id']
+            return folder_id
         except Exception as e:
             logging.error(f"Shared files upload failed: {str(e)}")
             raise
 
-    def _get_file_permissions(self, file_id):
-        """Get sharing permissions of a file/folder"""
-        try:
-            permissions = self.source_service.permissions().list(
-                fileId=file_id,
-                fields='permissions(emailAddress,role,type,domain)'
-            ).execute()
-            return permissions.get('permissions', [])
-        except Exception as e:
-            logging.error(f"Error getting permissions for file {file_id}: {str(e)}")
-            return []
-
     def _map_email_domain(self, source_email, source_domain, target_domain):
         """Map email from source domain to target domain"""
         username = source_email.split('@')[0]
         return f"{username}@{target_domain}"
 
-    def _migrate_sharing_permissions(self, source_file_id, dest_file_id, source_domain, target_domain):
-        """Migrate sharing permissions from source to destination"""
-        permissions = self._get_file_permissions(source_file_id)
-        
-        for permission in permissions:
-            try:
-                if permission.get('emailAddress'):
-                    if source_domain in permission['emailAddress']:
-                        new_email = self._map_email_domain(
-                            permission['emailAddress'],
-                            source_domain,
-                            target_domain
-                        )
-                        
-                        new_permission = {
-                            'type': 'user',
-                            'role': permission['role'],
-                            'emailAddress': new_email
-                        }
-                        
-                        self.dest_service.permissions().create(
-                            fileId=dest_file_id,
-                            body=new_permission,
-                            sendNotificationEmail=False
-                        ).execute()
-                        logging.info(f"Shared {dest_file_id} with {new_email}")
-                        
-                elif permission.get('domain') == source_domain:
-                    new_permission = {
-                        'type': 'domain',
-                        'role': permission['role'],
-                        'domain': target_domain
-                    }
-                    
-                    self.dest_service.permissions().create(
-                        fileId=dest_file_id,
-                        body=new_permission,
-                        sendNotificationEmail=False
-                    ).execute()
-                    logging.info(f"Shared {dest_file_id} with domain {target_domain}")
-                    
-            except Exception as e:
-                logging.error(f"Error migrating permission: {str(e)}")
-
-    def _store_file_mapping(self, source_id, dest_id):
+    def _map_permission(self, permission, source_domain, target_domain):
+        """Translate a source permission into the body to create on the destination"""
+        if not source_domain or not target_domain:
+            return None
+        if permission.get('role') == 'owner':
+            # The destination account already owns everything it uploads
+            return None
+        if permission.get('emailAddress'):
+            if source_domain in permission['emailAddress']:
+                return {
+                    'type': 'user',
+                    'role': permission['role'],
+                    'emailAddress': self._map_email_domain(
+                        permission['emailAddress'],
+                        source_domain,
+                        target_domain
+                    )
+                }
+        elif permission.get('domain') == source_domain:
+            return {
+                'type': 'domain',
+                'role': permission['role'],
+                'domain': target_domain
+            }
+        return None
+
+    def _migrate_sharing_permissions(self, source_file_id, dest_file_id, source_domain, target_domain, permissions=None):
+        """Queue sharing permissions for migration, sent in batches by the permission batcher"""
+        if not source_domain or not target_domain:
+            return
+        self.permission_batcher.add(source_file_id, dest_file_id, source_domain, target_domain, permissions)
+
+    def _store_file_mapping(self, scope, rel_path, source_id, dest_id, **fields):
         """Store mapping of source and destination file IDs"""
-        if not hasattr(self, 'file_mapping'):
-            self.file_mapping = {}
-        self.file_mapping[source_id] = dest_id
+        self.state.record(scope, rel_path, source_id=source_id, dest_id=dest_id, phase='uploaded', **fields)
 
-    def _get_source_file_id(self, file_path):
+    def _get_source_file_id(self, scope, rel_path):
         """Get source file ID from stored metadata"""
-        metadata_path = os.path.join(CONFIG['TEMP_DIR'], 'file_metadata.json')
         try:
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-                    return metadata.get(file_path)
+            return self.state.source_id_for(scope, rel_path)
         except Exception as e:
             logging.error(f"Error getting source file ID: {str(e)}")
         return None
 
 
-    def _upload_folder(self, local_path, parent_id, uploaded_files, resume_file, source_domain=None, target_domain=None):
-        # Initialize uploaded_files from resume file with encoding handling
-        if os.path.exists(resume_file):
-            try:
-                with open(resume_file, 'r', encoding='utf-8', errors='replace') as f:
-                    uploaded_files = set(f.read().splitlines())
-            except Exception as e:
-                logging.warning(f"Resume file read error, starting fresh: {str(e)}")
-                uploaded_files = set()
-
-        for item in os.listdir(local_path):
+    def _upload_folder(self, local_path, parent_id, scope, source_domain=None, target_domain=None):
+        scheduler = UploadScheduler(self, local_path, scope, source_domain, target_domain)
+        try:
+            result = scheduler.run(parent_id)
+            self.permission_batcher.flush()
+            return result
+        finally:
+            self.state.flush()
+
+
+
+    def _resumable_upload(self, request, scope, rel_path, content_version=None):
+        """Upload a resumable media request chunk by chunk, saving the session after each chunk.
+
+        The session URI and the offset the server confirmed are kept in the
+        state store, so a run that was interrupted mid-file continues the
+        same session from the last chunk instead of starting at byte zero.
+        A session is only resumed for the same content_version (source md5,
+        or version for Workspace files), so a source edited in between
+        never ends up spliced onto the old bytes.
+        """
+        size = request.resumable.size()
+        session = self.state.upload_session(scope, rel_path)
+        if (session and session['size'] == size and content_version and
+                session['content_version'] == content_version):
+            logging.info(f"Resuming upload of {rel_path} from byte {session['progress']}")
+            request.resumable_uri = session['uri']
+            request.resumable_progress = session['progress']
+            # Makes the next chunk ask the server how far the upload got first
+            request._in_error_state = True
+
+        start = time.monotonic()
+        response = None
+        while response is None:
             try:
-                # Clean the filename before constructing paths
-                cleaned_item = self._clean_filename(item)
-                item_path = os.path.join(local_path, cleaned_item)
-                original_path = os.path.join(local_path, item)
-                
-                if original_path in uploaded_files:
-                    logging.info(f"Skipping already uploaded: {item}")
-                    continue
-
-                if hasattr(self, 'ui'):
-                    self.ui.update_transfer_info(
-                        cleaned_item,
-                        "Uploading",
-                        self.current_file_count,
-                        self.total_files
-                    )
-
-                if os.path.exists(item_path):
-                    if os.path.isdir(item_path):
-                        folder_metadata = {
-                            'name': cleaned_item,
-                            'mimeType': 'application/vnd.google-apps.folder',
-                            'parents': [parent_id]
-                        }
-                        folder = self._retry_upload(self.dest_service.files().create(
-                            body=folder_metadata,
-                            fields='id'
-                        ))
-                        
-                        source_id = self._get_source_file_id(item_path)
-                        if source_id:
-                            self._migrate_sharing_permissions(source_id, folder['id'], source_domain, target_domain)
-                    
-                        self._upload_folder(item_path, folder['id'], uploaded_files, resume_file, source_domain, target_domain)
-                    else:
-                        file_metadata = {
-                            'name': cleaned_item,
-                            'parents': [parent_id]
-                        }
-                        media = MediaFileUpload(item_path, resumable=True)
-                        uploaded_file = self._retry_upload(self.dest_service.files().create(
-                            body=file_metadata,
-                            media_body=media,
-                            fields='id'
-                        ))
-                        
-                        source_id = self._get_source_file_id(item_path)
-                        if source_id:
-                            self._migrate_sharing_permissions(source_id, uploaded_file['id'], source_domain, target_domain)
-                    
-                        self.current_file_count += 1
-
-                        try:
-                            with open(resume_file, 'a', encoding='utf-8', errors='replace') as f:
-                                f.write(f"{original_path}\n")
-                            uploaded_files.add(original_path)
-                            logging.info(f"Uploaded: {cleaned_item}")
-                        except Exception as e:
-                            sanitized_path = original_path.encode('ascii', 'ignore').decode('ascii')
-                            with open(resume_file, 'a', encoding='utf-8', errors='replace') as f:
-                                f.write(f"{sanitized_path}\n")
-                            uploaded_files.add(sanitized_path)
-                            logging.info(f"Uploaded (sanitized): {cleaned_item}")
-                else:
-                    logging.warning(f"File not found, skipping: {item_path}")
-
-            except Exception as e:
-                logging.error(f"Error uploading {item}: {str(e)}")
-                continue  # Continue with next file instead of raising exception
+                status, response = self.requests.call(request.next_chunk, 'dest', 'media')
+            except googleapiclient.errors.HttpError as e:
+                if not request.resumable_uri or e.resp.status not in (404, 410):
+                    raise
+                # The session expired, start the file over in a new one
+                logging.warning(f"Upload session of {rel_path} expired, restarting")
+                self.state.clear_upload_session(scope, rel_path)
+                request.resumable_uri = None
+                request.resumable_progress = 0
+                request._in_error_state = False
+                continue
+            if status:
+                self.state.record_upload_session(
+                    scope, rel_path, request.resumable_uri, request.resumable_progress, size, content_version
+                )
 
-        return True
+        self.state.clear_upload_session(scope, rel_path)
+        self.metrics.record_phase('upload', time.monotonic() - start, size)
+        return response
 
+    def _retry_upload(self, request, endpoint='write'):
+        """Execute a destination request, use endpoint='media' for requests carrying file content"""
+        return self._make_request(request, 'dest', endpoint)
 
+    @staticmethod
+    def source_version(item):
+        """Version of a source item as it was when its content was fetched"""
+        return item.get('version') or item.get('modifiedTime')
 
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=2, min=4, max=60),
-        reraise=True
-    )
-    def _retry_upload(self, request):
-        try:
-            return request.execute(num_retries=5)
-        except (socket.error, googleapiclient.errors.HttpError) as e:
-            self.retry_count += 1
-            logging.warning(f"Retry attempt {self.retry_count}/{self.max_retries}: {str(e)}")
-            if self.retry_count >= self.max_retries:
-                logging.error("Max retries reached. Upload failed.")
-                raise RetryError("Upload failed after maximum retries")
-            raise
-        finally:
-            if self.retry_count >= self.max_retries:
-                self.retry_count = 0
+    @staticmethod
+    def content_version(item):
+        """What identifies the content of a source item: its md5, or version/modifiedTime for Workspace files"""
+        return item.get('md5Checksum') or item.get('version') or item.get('modifiedTime')
 
     def _clean_filename(self, filename):
         # Maximum length for Windows paths
@@ -644,38 +719,3 @@ class DriveManager:
             cleaned_name = name + extension
         
         return cleaned_name
-
-    def _get_or_create_folder(self, folder_path, destination_email):
-        if folder_path == '.':
-            return 'root'
-            
-        folder_names = folder_path.split(os.sep)
-        parent_id = 'root'
-        
-        for folder_name in folder_names:
-            if not folder_name:
-                continue
-                
-            query = f"name='{folder_name}' and '{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            results = self.dest_service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
-            
-            if results.get('files'):
-                parent_id = results.get('files')[0]['id']
-            else:
-                folder_metadata = {
-                    'name': folder_name,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [parent_id]
-                }
-                folder = self.dest_service.files().create(
-                    body=folder_metadata,
-                    fields='id'
-                ).execute()
-                parent_id = folder['id']
-        
-        return parent_id
-    
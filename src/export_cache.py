@@ -0,0 +1,177 @@
+import os
+import shutil
+import hashlib
+import logging
+import threading
+import googleapiclient.errors
+from config import CONFIG
+
+EXPORT_SIZE_LIMIT_REASON = 'exportSizeLimitExceeded'
+
+
+class ExportCache:
+    """Workspace exports kept on disk across retries and reruns.
+
+    Exporting Docs, Sheets and Slides is the slowest and most quota-heavy
+    call, so each export is stored under CONFIG['EXPORT_CACHE_DIR'] keyed
+    by (file ID, version or modifiedTime, export MIME type) and only
+    exported again once the document changed; older versions are dropped
+    when a new one is stored, and the least recently used exports once the
+    cache grows past CONFIG['EXPORT_CACHE_MAX_BYTES']. Exports go through their own 'export'
+    endpoint class, so the request executor caps them separately from
+    binary downloads. Files over the export size limit of files().export
+    are fetched through their exportLinks instead.
+    """
+
+    # Running total of the cached bytes per cache directory, shared by every DriveManager of a
+    # batch run, so the directory is only scanned when the total goes over max_bytes
+    totals = {}
+    totals_lock = threading.Lock()
+
+    def __init__(self, drive_manager):
+        self.drive_manager = drive_manager
+        self.cache_dir = CONFIG['EXPORT_CACHE_DIR']
+        self.max_bytes = CONFIG['EXPORT_CACHE_MAX_BYTES']
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with ExportCache.totals_lock:
+            key = os.path.abspath(self.cache_dir)
+            if key not in ExportCache.totals:
+                ExportCache.totals[key] = {
+                    'lock': threading.Lock(),
+                    'size': sum(size for _, size, _ in self._entries())
+                }
+            self.total = ExportCache.totals[key]
+        self.lock = self.total['lock']
+
+    def export(self, item, export_mime):
+        """Exported content of a Workspace file, rewound; the caller closes it"""
+        path = self._path(item, export_mime)
+        if path:
+            try:
+                fh = open(path, 'rb')
+            except FileNotFoundError:
+                pass
+            else:
+                # The modification time marks the last use for eviction
+                os.utime(path)
+                self.drive_manager.metrics.count('export_cache_hits_total')
+                logging.info(f"Using cached export of {item['name']}")
+                return fh
+
+        self.drive_manager.metrics.count('export_cache_misses_total')
+        fh = self._export(item, export_mime)
+        if path:
+            try:
+                self._store(fh, path)
+                self._evict(path)
+            except OSError as e:
+                logging.warning(f"Could not cache export of {item['name']}: {str(e)}")
+        return fh
+
+    def _path(self, item, export_mime):
+        version = item.get('version') or item.get('modifiedTime')
+        if not version:
+            # Nothing to tell a changed document from an unchanged one
+            return None
+        digest = hashlib.sha1(f"{version}:{export_mime}".encode('utf-8')).hexdigest()[:16]
+        # One directory per file, so finding its older versions never lists the whole cache
+        return os.path.join(self.cache_dir, item['id'], digest)
+
+    def _store(self, fh, path):
+        # Write then rename, so an interrupted run never leaves half an export behind
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'wb') as cached:
+                shutil.copyfileobj(fh, cached, CONFIG['DOWNLOAD_CHUNK_SIZE'])
+            stored = os.path.getsize(f'{path}.tmp')
+            # Another export thread may have cached the same version first
+            replaced = self._size(path)
+            os.replace(f'{path}.tmp', path)
+        finally:
+            # The caller uploads from fh whether or not caching worked
+            fh.seek(0)
+        freed = 0
+        for entry in os.scandir(os.path.dirname(path)):
+            if entry.path != path and not entry.name.endswith('.tmp'):
+                freed += self._remove(entry.path)
+        with self.lock:
+            self.total['size'] += stored - replaced - freed
+
+    def _evict(self, keep):
+        """Drop the least recently used exports until the cache fits in max_bytes"""
+        with self.lock:
+            if self.total['size'] <= self.max_bytes:
+                return
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path != keep:
+                    total -= self._remove(path)
+                    self._remove_folder(os.path.dirname(path))
+            # The scan also corrects the running total for exports it did not see stored
+            self.total['size'] = total
+
+    def _entries(self):
+        """(mtime, size, path) of every cached export"""
+        entries = []
+        for top in os.scandir(self.cache_dir):
+            # Exports cached before the per-file directories sit at the top, they age out like the rest
+            for entry in (os.scandir(top.path) if top.is_dir() else [top]):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _remove_folder(self, folder):
+        if folder == self.cache_dir:
+            return
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # Still holds another version, or an export being written
+            pass
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    @classmethod
+    def _remove(cls, path):
+        """Delete a cached export, returns the bytes freed"""
+        size = cls._size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already dropped by another export thread
+            return 0
+        return size
+
+    def _export(self, item, export_mime):
+        files = self.drive_manager.source_service.files()
+        request = files.export_media(fileId=item['id'], mimeType=export_mime)
+        try:
+            return self.drive_manager._download_to_spool(request, phase='export', endpoint='export')
+        except googleapiclient.errors.HttpError as e:
+            if e.resp.status != 403 or EXPORT_SIZE_LIMIT_REASON not in str(e.content):
+                raise
+        logging.info(f"{item['name']} is too large for files().export, downloading its export link")
+        return self._export_link(item, export_mime)
+
+    def _export_link(self, item, export_mime):
+        links = self.drive_manager._make_request(
+            self.drive_manager.source_service.files().get(
+                fileId=item['id'], fields='exportLinks', supportsAllDrives=True
+            ),
+            'source', 'export'
+        ).get('exportLinks', {})
+        if export_mime not in links:
+            raise ValueError(f"No {export_mime} export link for {item['name']}")
+        # Same authorized request, pointed at the export link
+        request = self.drive_manager.source_service.files().export_media(fileId=item['id'], mimeType=export_mime)
+        request.uri = links[export_mime]
+        return self.drive_manager._download_to_spool(request, phase='export', endpoint='export')
@@ -0,0 +1,505 @@
+from googleapiclient.errors import HttpError
+from urllib.parse import urlparse, parse_qs
+import re
+import time
+import random
+import hashlib
+import itertools
+import threading
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+DOCUMENT_MIME_TYPE = 'application/vnd.google-apps.document'
+EXPORT_SIZE = 32 * 1024  # Bytes an exported Workspace file comes out as
+PATTERN_SIZE = 4096
+
+# Synthetic tree presets: folders per level, depth, files per folder, file size, share of Google Docs
+SHAPES = {
+    'deep': {'folders': 1, 'depth': 20, 'files': 10, 'size': 64 * 1024, 'docs': 0.0},
+    'wide': {'folders': 1, 'depth': 1, 'files': 5000, 'size': 16 * 1024, 'docs': 0.0},
+    'tiny': {'folders': 5, 'depth': 3, 'files': 40, 'size': 1024, 'docs': 0.0},
+    'huge': {'folders': 1, 'depth': 1, 'files': 3, 'size': 512 * 1024 * 1024, 'docs': 0.0},
+    'mixed': {'folders': 3, 'depth': 3, 'files': 20, 'size': 256 * 1024, 'docs': 0.1},
+}
+
+
+class FakeResponse(dict):
+    """Stand-in for httplib2.Response: header dict plus status"""
+
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+        self.reason = 'OK' if status < 400 else 'Error'
+
+
+class FakeCloud:
+    """In-memory Drive v3 shared by every fake account.
+
+    Files are metadata only; content is generated from a per-file pattern
+    when it is read, so trees of any size cost almost no memory. Every
+    call sleeps `latency` seconds (plus size / `bandwidth` for media) and
+    fails with a 5xx at `error_rate` or a 429 at `throttle_rate`, so the
+    retry, throttling and concurrency paths of the engine get exercised.
+    """
+
+    def __init__(self, latency=0.05, bandwidth=None, error_rate=0.0, throttle_rate=0.0, seed=0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.files = {}
+        self.drives = {}
+        self.changes = []
+        self.sessions = {}
+        self.calls = 0
+
+    def service(self, account):
+        return FakeDriveService(self, account)
+
+    def new_id(self, prefix='f'):
+        with self.lock:
+            return f'{prefix}{next(self.ids)}'
+
+    def root_id(self, account):
+        root = f'root-{account}'
+        with self.lock:
+            if root not in self.files:
+                self.files[root] = {'id': root, 'name': 'My Drive', 'mimeType': FOLDER_MIME_TYPE, 'owner': account}
+        return root
+
+    def simulate(self, size=0):
+        """Pay the simulated cost of one call and maybe fail it"""
+        with self.lock:
+            self.calls += 1
+            roll = self.random.random()
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        if roll < self.throttle_rate:
+            raise HttpError(
+                FakeResponse(429, {'retry-after': '1'}),
+                b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}'
+            )
+        if roll < self.throttle_rate + self.error_rate:
+            raise HttpError(FakeResponse(503), b'{"error": {"message": "Backend Error"}}')
+
+    def get(self, file_id):
+        with self.lock:
+            item = self.files.get(file_id)
+        if item is None:
+            raise HttpError(FakeResponse(404), f'File not found: {file_id}'.encode())
+        return item
+
+    def add_file(self, account, name, mime_type, parent, size=0, **fields):
+        item = {
+            'id': self.new_id(),
+            'name': name,
+            'mimeType': mime_type,
+            'parents': [parent],
+            'owner': account,
+            'modifiedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            'permissions': [],
+            'permissionIds': [],
+            'trashed': False,
+            **fields
+        }
+        if mime_type != FOLDER_MIME_TYPE and not mime_type.startswith('application/vnd.google-apps'):
+            item['size'] = str(size)
+            if 'md5Checksum' not in item:
+                item['md5Checksum'] = self.checksum(item['id'], size)
+        with self.lock:
+            self.files[item['id']] = item
+            self.changes.append(item['id'])
+        return item
+
+    def touch(self, item):
+        with self.lock:
+            item['modifiedTime'] = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+            self.changes.append(item['id'])
+
+    def content(self, file_id, start, end):
+        """Bytes start..end (inclusive) of a file's generated content"""
+        pattern = hashlib.sha256(file_id.encode()).digest() * (PATTERN_SIZE // 32)
+        offset = start % PATTERN_SIZE
+        length = end - start + 1
+        return (pattern * ((offset + length) // PATTERN_SIZE + 1))[offset:offset + length]
+
+    def checksum(self, file_id, size):
+        digest = hashlib.md5()
+        block = 8 * 1024 * 1024
+        for start in range(0, size, block):
+            digest.update(self.content(file_id, start, min(start + block, size) - 1))
+        return digest.hexdigest()
+
+    def populate(self, account, folders=1, depth=1, files=10, size=1024, docs=0.0):
+        """Build a synthetic tree in an account's My Drive, returns (files, bytes) created"""
+        total_files = total_bytes = 0
+        level = [self.root_id(account)]
+        for depth_index in range(depth):
+            next_level = []
+            for parent in level:
+                for folder_index in range(folders):
+                    folder = self.add_file(account, f'folder_{depth_index}_{folder_index}', FOLDER_MIME_TYPE, parent)
+                    next_level.append(folder['id'])
+                    for file_index in range(files):
+                        if self.random.random() < docs:
+                            self.add_file(account, f'doc_{file_index}', DOCUMENT_MIME_TYPE, folder['id'])
+                        else:
+                            self.add_file(account, f'file_{file_index}.bin', 'application/octet-stream',
+                                          folder['id'], size)
+                            total_bytes += size
+                        total_files += 1
+            level = next_level
+        return total_files, total_bytes
+
+
+class FakeProgress:
+    """Stand-in for MediaUploadProgress"""
+
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+class FakeRequest:
+    """Mimics googleapiclient.http.HttpRequest for one call"""
+
+    def __init__(self, cloud, handler, uri=None, media_body=None):
+        self.cloud = cloud
+        self.handler = handler
+        self.headers = {}
+        self.uri = uri
+        self.http = FakeHttp(cloud)
+        self.resumable = media_body
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self._in_error_state = False
+
+    def execute(self, num_retries=0, http=None):
+        if self.resumable is not None:
+            response = None
+            while response is None:
+                _, response = self.next_chunk()
+            return response
+        if self.uri:
+            # Media request, honour a Range header like the real endpoint
+            resp, content = self.http.request(self.uri, 'GET', headers=self.headers)
+            if resp.status not in (200, 206):
+                raise HttpError(resp, content)
+            return content
+        self.cloud.simulate()
+        return self.handler()
+
+    def next_chunk(self, http=None, num_retries=0):
+        """Resumable upload of media_body, one chunk per call"""
+        media = self.resumable
+        cloud = self.cloud
+        if self.resumable_uri is None:
+            cloud.simulate()
+            self.resumable_uri = f'fake-session://{cloud.new_id("s")}'
+            with cloud.lock:
+                cloud.sessions[self.resumable_uri] = {'progress': 0, 'md5': hashlib.md5()}
+            self.resumable_progress = 0
+
+        with cloud.lock:
+            session = cloud.sessions.get(self.resumable_uri)
+        if session is None:
+            raise HttpError(FakeResponse(404), b'Upload session expired')
+        if self._in_error_state:
+            # Ask the server how far it got
+            cloud.simulate()
+            self.resumable_progress = session['progress']
+            self._in_error_state = False
+
+        total = media.size()
+        data = media.getbytes(self.resumable_progress, media.chunksize())
+        try:
+            cloud.simulate(len(data))
+        except HttpError:
+            self._in_error_state = True
+            raise
+        session['md5'].update(data)
+        session['progress'] = self.resumable_progress = self.resumable_progress + len(data)
+        if self.resumable_progress < total:
+            return FakeProgress(self.resumable_progress, total), None
+
+        with cloud.lock:
+            del cloud.sessions[self.resumable_uri]
+        return None, self.handler(total, session['md5'].hexdigest())
+
+
+class FakeHttp:
+    """Answers the ranged GETs MediaIoBaseDownload sends"""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        parsed = urlparse(uri)
+        item = self.cloud.get(parsed.netloc)
+        export = parse_qs(parsed.query).get('export')
+        size = EXPORT_SIZE if export else int(item.get('size') or 0)
+
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        match = re.match(r'bytes=(\d+)-(\d*)', headers.get('range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            status = 206
+        else:
+            start, end, status = 0, size - 1, 200
+        try:
+            self.cloud.simulate(max(0, end - start + 1))
+        except HttpError as e:
+            return e.resp, e.content
+        content = self.cloud.content(item['id'], start, end) if size else b''
+        return FakeResponse(status, {
+            'content-range': f'bytes {start}-{end}/{size}',
+            'content-length': str(len(content))
+        }), content
+
+
+class FakeDriveService:
+    """The subset of the Drive v3 service the migration engine calls, for one account"""
+
+    def __init__(self, cloud, account):
+        self.cloud = cloud
+        self.account = account
+
+    def files(self):
+        return FakeFiles(self)
+
+    def permissions(self):
+        return FakePermissions(self)
+
+    def drives(self):
+        return FakeDrives(self)
+
+    def changes(self):
+        return FakeChanges(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.cloud, callback)
+
+
+class FakeFiles:
+    def __init__(self, service):
+        self.service = service
+        self.cloud = service.cloud
+        self.account = service.account
+
+    def _request(self, handler, **kwargs):
+        return FakeRequest(self.cloud, handler, **kwargs)
+
+    def _public(self, item):
+        public = {key: value for key, value in item.items() if key != 'owner'}
+        public['owners'] = [{'emailAddress': item['owner']}]
+        return public
+
+    def list(self, q='', pageToken=None, pageSize=100, driveId=None, **kwargs):
+        def handler():
+            with self.cloud.lock:
+                items = [item for item in self.cloud.files.values() if self._matches(item, q, driveId)]
+            start = int(pageToken or 0)
+            page = items[start:start + pageSize]
+            response = {'files': [self._public(item) for item in page]}
+            if start + pageSize < len(items):
+                response['nextPageToken'] = str(start + pageSize)
+            return response
+        return self._request(handler)
+
+    def _matches(self, item, q, drive_id):
+        if item['id'].startswith('root-') or item.get('trashed') and 'trashed=false' in q:
+            return False
+        if drive_id:
+            return item.get('driveId') == drive_id
+        if 'sharedWithMe=true' in q:
+            return item['owner'] != self.account and any(
+                permission.get('emailAddress') == self.account for permission in item['permissions']
+            )
+        if item.get('driveId') or item['owner'] != self.account:
+            return False
+        parent = re.search(r"'([^']+)' in parents", q)
+        if parent and parent.group(1) not in item['parents']:
+            return False
+        name = re.search(r"name\s*=\s*'((?:[^'\\]|\\.)*)'", q)
+        if name and item['name'] != name.group(1).replace("\\'", "'"):
+            return False
+        mime_type = re.search(r"mimeType\s*=\s*'([^']+)'", q)
+        return not mime_type or item['mimeType'] == mime_type.group(1)
+
+    def get(self, fileId, fields=None, **kwargs):
+        def handler():
+            if fileId == 'root':
+                return {'id': self.cloud.root_id(self.account)}
+            return self._public(self.cloud.get(fileId))
+        return self._request(handler)
+
+    def get_media(self, fileId, **kwargs):
+        return self._request(None, uri=f'fake://{fileId}')
+
+    def export_media(self, fileId, mimeType, **kwargs):
+        return self._request(None, uri=f'fake://{fileId}?export={mimeType}')
+
+    def create(self, body, media_body=None, fields=None, **kwargs):
+        parents = [self._resolve(parent) for parent in body.get('parents') or ['root']]
+
+        def handler(size=0, md5=None):
+            fields = {'md5Checksum': md5} if md5 else {}
+            item = self.cloud.add_file(
+                self.account, body['name'], body.get('mimeType') or 'application/octet-stream',
+                parents[0], size, **fields
+            )
+            return {'id': item['id']}
+        return self._request(handler, media_body=media_body)
+
+    def update(self, fileId, body=None, media_body=None, addParents=None, removeParents=None, fields=None, **kwargs):
+        def handler(size=None, md5=None):
+            item = self.cloud.get(fileId)
+            with self.cloud.lock:
+                item.update(body or {})
+                if removeParents:
+                    item['parents'] = [p for p in item['parents'] if p not in removeParents.split(',')]
+                if addParents:
+                    item['parents'] = item['parents'] + [self._resolve(addParents)]
+                if size is not None:
+                    item['size'] = str(size)
+                    item['md5Checksum'] = md5
+            self.cloud.touch(item)
+            return {'id': item['id']}
+        return self._request(handler, media_body=media_body)
+
+    def copy(self, fileId, body=None, fields=None, **kwargs):
+        def handler():
+            source = self.cloud.get(fileId)
+            parents = (body or {}).get('parents') or ['root']
+            item = self.cloud.add_file(
+                self.account, (body or {}).get('name', source['name']), source['mimeType'],
+                self._resolve(parents[0]), int(source.get('size') or 0),
+                **({'md5Checksum': source['md5Checksum']} if 'md5Checksum' in source else {})
+            )
+            return {'id': item['id']}
+        return self._request(handler)
+
+    def _resolve(self, parent):
+        return self.cloud.root_id(self.account) if parent == 'root' else parent
+
+
+class FakePermissions:
+    def __init__(self, service):
+        self.cloud = service.cloud
+
+    def list(self, fileId, **kwargs):
+        def handler():
+            with self.cloud.lock:
+                drive = self.cloud.drives.get(fileId)
+                if drive is not None:
+                    # Shared drive members, as listed on the drive id
+                    return {'permissions': [
+                        {'id': f'member-{member}', 'type': 'user', 'emailAddress': member, 'role': 'organizer'}
+                        for member in drive['members']
+                    ]}
+            return {'permissions': list(self.cloud.get(fileId)['permissions'])}
+        return FakeRequest(self.cloud, handler)
+
+    def create(self, fileId, body, **kwargs):
+        def handler():
+            with self.cloud.lock:
+                drive = self.cloud.drives.get(fileId)
+                if drive is not None:
+                    drive['members'].append(body['emailAddress'])
+                    return {'id': f"member-{body['emailAddress']}"}
+            item = self.cloud.get(fileId)
+            permission = {'id': self.cloud.new_id('p'), **body}
+            with self.cloud.lock:
+                item['permissions'].append(permission)
+                item['permissionIds'].append(permission['id'])
+            return {'id': permission['id']}
+        return FakeRequest(self.cloud, handler)
+
+    def delete(self, fileId, permissionId, **kwargs):
+        def handler():
+            item = self.cloud.get(fileId)
+            with self.cloud.lock:
+                item['permissions'] = [p for p in item['permissions'] if p['id'] != permissionId]
+                item['permissionIds'] = [p for p in item['permissionIds'] if p != permissionId]
+            return ''
+        return FakeRequest(self.cloud, handler)
+
+
+class FakeDrives:
+    def __init__(self, service):
+        self.cloud = service.cloud
+        self.account = service.account
+
+    def list(self, pageToken=None, **kwargs):
+        def handler():
+            with self.cloud.lock:
+                drives = [
+                    {'id': drive['id'], 'name': drive['name']}
+                    for drive in self.cloud.drives.values() if self.account in drive['members']
+                ]
+            return {'drives': drives}
+        return FakeRequest(self.cloud, handler)
+
+    def create(self, body, requestId=None, **kwargs):
+        def handler():
+            drive = {'id': self.cloud.new_id('d'), 'name': body['name'], 'members': [self.account]}
+            with self.cloud.lock:
+                self.cloud.drives[drive['id']] = drive
+            return {'id': drive['id'], 'name': drive['name']}
+        return FakeRequest(self.cloud, handler)
+
+
+class FakeChanges:
+    def __init__(self, service):
+        self.cloud = service.cloud
+        self.account = service.account
+
+    def getStartPageToken(self, **kwargs):
+        return FakeRequest(self.cloud, lambda: {'startPageToken': str(len(self.cloud.changes))})
+
+    def list(self, pageToken, pageSize=100, **kwargs):
+        def handler():
+            with self.cloud.lock:
+                ids = self.cloud.changes[int(pageToken):]
+                files = [self.cloud.files[file_id] for file_id in ids if file_id in self.cloud.files]
+                token = len(self.cloud.changes)
+            changes = [
+                {'fileId': item['id'], 'removed': False, 'file': {**item, 'ownedByMe': True}}
+                for item in files if item['owner'] == self.account
+            ]
+            return {'changes': changes, 'newStartPageToken': str(token)}
+        return FakeRequest(self.cloud, handler)
+
+
+class FakeBatch:
+    """One round trip for up to 100 calls, each answered through the callback"""
+
+    def __init__(self, cloud, callback):
+        self.cloud = cloud
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.cloud.simulate()
+        for request_id, request, callback in self.requests:
+            try:
+                # Sub-requests fail like single calls but share the batch round trip
+                with self.cloud.lock:
+                    roll = self.cloud.random.random()
+                if roll < self.cloud.throttle_rate:
+                    raise HttpError(FakeResponse(429), b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}')
+                response = request.handler()
+            except HttpError as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from collections import defaultdict
+import os
+import json
+import time
+import logging
+import threading
+from config import CONFIG
+
+# Upper bounds (seconds) of the latency histogram buckets, the last one catches everything else
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return 0.0
+
+
+class Metrics:
+    """Counters and latency histograms for one migration run.
+
+    API calls are recorded per account and endpoint class by the request
+    executor, transfer work per phase (crawl, download, export, extract,
+    upload, copy, permissions). A background thread writes a JSON snapshot
+    and a Prometheus textfile to LOG_DIR every CONFIG['METRICS_INTERVAL']
+    seconds, and close() logs a summary of the whole run.
+    """
+
+    def __init__(self, name='migration'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+        # phase -> [first start, last end] in time.monotonic(), the phase's own wall time
+        self.spans = {}
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.exporter = None
+
+    def count(self, metric, value=1, **labels):
+        with self.lock:
+            self.counters[(metric, tuple(sorted(labels.items())))] += value
+
+    def observe(self, metric, seconds, **labels):
+        with self.lock:
+            self.histograms[(metric, tuple(sorted(labels.items())))].observe(seconds)
+
+    def record_phase(self, phase, seconds, size=0, items=1):
+        end = time.monotonic()
+        with self.lock:
+            span = self.spans.setdefault(phase, [end - seconds, end])
+            span[0] = min(span[0], end - seconds)
+            span[1] = max(span[1], end)
+        self.observe('phase_seconds', seconds, phase=phase)
+        self.count('phase_items_total', items, phase=phase)
+        if size:
+            self.count('phase_bytes_total', size, phase=phase)
+
+    @contextmanager
+    def phase(self, phase, items=1):
+        """Time a block of work; set ['bytes'] on the yielded dict to count its size"""
+        info = {'bytes': 0, 'items': items}
+        start = time.monotonic()
+        yield info
+        self.record_phase(phase, time.monotonic() - start, info['bytes'], info['items'])
+
+    def start(self):
+        if CONFIG['METRICS_INTERVAL'] and not self.exporter:
+            self.exporter = threading.Thread(target=self._export_loop, name='metrics', daemon=True)
+            self.exporter.start()
+
+    def _export_loop(self):
+        while not self.stopped.wait(CONFIG['METRICS_INTERVAL']):
+            self.export()
+
+    def close(self):
+        self.stopped.set()
+        self.export()
+        for line in self.summary():
+            logging.info(line)
+
+    def export(self):
+        try:
+            base = os.path.join(CONFIG['LOG_DIR'], f'metrics_{self.name}')
+            self._write(f'{base}.json', json.dumps(self.snapshot(), indent=2))
+            self._write(f'{base}.prom', self.prometheus())
+        except Exception as e:
+            logging.warning(f"Could not write metrics: {str(e)}")
+
+    def _write(self, path, content):
+        # Write then rename, so readers never see half a file
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'elapsed_seconds': time.time() - self.started,
+                'phase_durations': {phase: end - start for phase, (start, end) in self.spans.items()},
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': histogram.count,
+                        'sum': histogram.total,
+                        'buckets': {str(bound): count for bound, count in zip(BUCKETS, histogram.counts)}
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ]
+            }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f'drive_migration_{name}{_labels(labels)} {value:g}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    lines.append(f'drive_migration_{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'drive_migration_{name}_sum{_labels(labels)} {histogram.total:g}')
+                lines.append(f'drive_migration_{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Human readable end of run report, one line per phase and endpoint"""
+        elapsed = max(time.time() - self.started, 0.001)
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+            spans = dict(self.spans)
+
+        lines = [f"=== Run metrics ({elapsed:.0f}s) ==="]
+        for (name, labels), histogram in sorted(histograms.items()):
+            labels = dict(labels)
+            if name == 'phase_seconds':
+                phase = labels['phase']
+                items = counters.get(('phase_items_total', (('phase', phase),)), 0)
+                size = counters.get(('phase_bytes_total', (('phase', phase),)), 0)
+                # Rates over the phase's own span, from its first start to its last end
+                start, end = spans.get(phase, (0, elapsed))
+                duration = max(end - start, 0.001)
+                lines.append(
+                    f"{phase}: {items:g} items, {size / 1048576:.1f} MB in {duration:.0f}s, "
+                    f"{items / duration:.2f} items/s, {size / 1048576 / duration:.2f} MB/s, "
+                    f"p50 {histogram.quantile(0.5):g}s, p95 {histogram.quantile(0.95):g}s"
+                )
+            elif name == 'api_request_seconds':
+                key = tuple(sorted(labels.items()))
+                errors = counters.get(('api_errors_total', key), 0)
+                retries = counters.get(('api_retries_total', key), 0)
+                throttled = counters.get(('api_throttled_total', key), 0)
+                lines.append(
+                    f"API {labels['account']}/{labels['endpoint']}: {histogram.count} calls, "
+                    f"{errors:g} errors, {retries:g} retries, {throttled:g} throttled, "
+                    f"avg {histogram.total / histogram.count:.2f}s, p95 {histogram.quantile(0.95):g}s"
+                )
+        return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
@@ -0,0 +1,148 @@
+import time
+import random
+import logging
+import threading
+from request_executor import is_retryable, is_throttled
+from config import CONFIG
+
+class PermissionBatcher:
+    """Migrate sharing permissions through the Drive batch endpoint.
+
+    Jobs (source item, destination item) are collected until
+    CONFIG['PERMISSION_BATCH_SIZE'] are pending, then the missing source
+    permissions are read and the mapped permissions created in batches of
+    up to 100 calls. Only the sub-requests that fail with a retryable
+    error are sent again.
+    """
+
+    MAX_BATCH_CALLS = 100
+
+    def __init__(self, drive_manager):
+        self.drive_manager = drive_manager
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, source_id, dest_id, source_domain, target_domain, permissions=None):
+        with self.lock:
+            self.pending.append((source_id, dest_id, source_domain, target_domain, permissions))
+            if len(self.pending) < CONFIG['PERMISSION_BATCH_SIZE']:
+                return
+            jobs, self.pending = self.pending, []
+        self._process(jobs)
+
+    def flush(self):
+        with self.lock:
+            jobs, self.pending = self.pending, []
+        if jobs:
+            self._process(jobs)
+
+    def _process(self, jobs):
+        missing = [job[0] for job in jobs if job[4] is None]
+        fetched = self._read_permissions(missing) if missing else {}
+
+        creates = []
+        for source_id, dest_id, source_domain, target_domain, permissions in jobs:
+            if permissions is None:
+                permissions = fetched.get(source_id, [])
+            for permission in permissions:
+                body = self.drive_manager._map_permission(permission, source_domain, target_domain)
+                if body:
+                    creates.append((dest_id, body))
+
+        if creates:
+            with self.drive_manager.metrics.phase('permissions', items=len(creates)):
+                self._create_permissions(creates)
+
+    def _read_permissions(self, source_ids):
+        calls = {
+            source_id: (lambda source_id=source_id: self.drive_manager.source_service.permissions().list(
+                fileId=source_id,
+                fields='permissions(emailAddress,role,type,domain,permissionDetails(inherited))',
+                supportsAllDrives=True
+            ))
+            for source_id in source_ids
+        }
+        results = self._execute('source', calls)
+        return {
+            # Shared drive items list the drive's members as inherited, those are migrated on the drive
+            source_id: [
+                permission for permission in (response or {}).get('permissions', [])
+                if not self._inherited(permission)
+            ]
+            for source_id, response in results.items()
+        }
+
+    @staticmethod
+    def _inherited(permission):
+        details = permission.get('permissionDetails')
+        return bool(details) and all(detail.get('inherited') for detail in details)
+
+    def _create_permissions(self, creates):
+        calls = {
+            str(i): (lambda dest_id=dest_id, body=body: self.drive_manager.dest_service.permissions().create(
+                fileId=dest_id,
+                body=body,
+                sendNotificationEmail=False,
+                supportsAllDrives=True
+            ))
+            for i, (dest_id, body) in enumerate(creates)
+        }
+        results = self._execute('dest', calls)
+        for key, response in results.items():
+            if response is not None:
+                dest_id, body = creates[int(key)]
+                logging.info(f"Shared {dest_id} with {body.get('emailAddress') or 'domain ' + body.get('domain')}")
+
+    def _execute(self, account, calls):
+        """Run request factories in batches, retrying only failed entries.
+
+        Returns request key -> response, or None for entries that failed.
+        """
+        results = {}
+        remaining = list(calls)
+        attempt = 0
+        while remaining:
+            retry = []
+            for start in range(0, len(remaining), self.MAX_BATCH_CALLS):
+                chunk = remaining[start:start + self.MAX_BATCH_CALLS]
+                retry.extend(self._execute_chunk(account, calls, chunk, results))
+            if not retry:
+                break
+            if attempt >= CONFIG['PERMISSION_BATCH_RETRIES']:
+                for key in retry:
+                    logging.error(f"Permission request {key} still failing after {attempt} retries")
+                    results[key] = None
+                break
+            time.sleep(min(60, 2 ** attempt) + random.random())
+            attempt += 1
+            remaining = retry
+        return results
+
+    def _execute_chunk(self, account, calls, chunk, results):
+        retry = []
+        service = self.drive_manager.source_service if account == 'source' else self.drive_manager.dest_service
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            elif is_retryable(exception):
+                if is_throttled(exception):
+                    self.drive_manager.requests.report_throttle(account, 'permissions')
+                retry.append(request_id)
+            else:
+                logging.error(f"Error migrating permission: {str(exception)}")
+                results[request_id] = None
+
+        batch = service.new_batch_http_request(callback=callback)
+        for key in chunk:
+            batch.add(calls[key](), request_id=key)
+        try:
+            # Sent once: a retried batch would repeat the entries whose callbacks already succeeded,
+            # _execute sends the rest again in the next round
+            self.drive_manager.requests.call(batch.execute, account, 'permissions', max_attempts=1)
+        except Exception as e:
+            if is_throttled(e):
+                self.drive_manager.requests.report_throttle(account, 'permissions')
+            logging.warning(f"Permission batch failed, retrying the entries without a response: {str(e)}")
+            return [key for key in chunk if key not in results]
+        return retry
@@ -0,0 +1,251 @@
+from collections import Counter
+from datetime import timedelta
+import os
+import json
+import math
+import time
+import logging
+from drive_index import DriveIndex, FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE, inline_permissions
+from config import CONFIG
+
+PLAN_FILE = 'migration_plan.json'
+
+
+def plan_path(drive_manager):
+    return os.path.join(drive_manager.work_dir, PLAN_FILE)
+
+
+def load_index(drive_manager, scope):
+    """DriveIndex of a scope from a saved plan, or None when there is no fresh plan for it"""
+    path = plan_path(drive_manager)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable plan {path}: {str(e)}")
+        return None
+
+    age = time.time() - plan.get('created', 0)
+    source = plan.get('sources', {}).get(scope)
+    if source is None or age > CONFIG['PLAN_MAX_AGE']:
+        return None
+    logging.info(f"Using the {scope} listing saved by the plan {age / 60:.0f} minutes ago")
+    return DriveIndex.from_items(source['root_id'], drive_manager._clean_filename, source['items'])
+
+
+class MigrationPlanner:
+    """Dry run: crawl every source and estimate the migration without transferring anything.
+
+    My Drive, each shared drive and the items shared with the user are
+    listed once. For each source the planner counts files, folders and
+    shortcuts, adds up size/quotaBytesUsed, counts Workspace exports by
+    type and the permission creates the run will send, then turns those
+    into API calls per endpoint class and a wall-clock estimate using
+    CONFIG['RATE_LIMITS'] and CONFIG['PLAN_THROUGHPUT']. The plan, listings
+    included, is saved in the user's work directory so the real run can
+    index from it instead of crawling again.
+    """
+
+    def __init__(self, drive_manager, source_domain=None, target_domain=None):
+        self.drive_manager = drive_manager
+        self.source_domain = source_domain
+        self.target_domain = target_domain
+
+    def run(self, user_email, shared_drives=True, shared_with_me=True):
+        dm = self.drive_manager
+        sources = {}
+        with dm.metrics.phase('crawl') as phase:
+            sources['my_drive'] = self._plan_source(DriveIndex.crawl(dm, dm.source_service))
+            if shared_drives:
+                for drive in dm.list_shared_drives(user_email):
+                    index = DriveIndex.crawl_shared_drive(dm, dm.source_service, drive['id'])
+                    sources[f"shared_drive:{drive['id']}"] = self._plan_source(index, drive['name'], drive['id'])
+            if shared_with_me:
+                # Only the shared items themselves are listed, not the contents of shared folders
+                items = dm._list_files(
+                    dm.source_service,
+                    q='sharedWithMe=true and trashed=false',
+                    fields=f"nextPageToken, files({DriveIndex.FIELDS}, owners)"
+                )
+                owned = [item for item in items if item['owners'][0]['emailAddress'] == user_email]
+                index = DriveIndex.from_items('shared_with_me', dm._clean_filename, owned)
+                sources['shared_with_me'] = self._plan_source(index)
+            phase['items'] = sum(source['totals']['files'] + source['totals']['folders'] for source in sources.values())
+
+        plan = {
+            'created': time.time(),
+            'source_email': user_email,
+            'sources': sources,
+            'estimate': self._combine([source['estimate'] for source in sources.values()])
+        }
+        self.save(plan)
+        for line in self.describe(plan):
+            logging.info(line)
+        return plan
+
+    def save(self, plan):
+        path = plan_path(self.drive_manager)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(plan, f)
+        os.replace(f'{path}.tmp', path)
+        logging.info(f"Plan saved to {path}")
+
+    def _plan_source(self, index, name=None, drive_id=None):
+        totals = self._totals(index, shared_drive=drive_id is not None)
+        if drive_id and self.source_domain and self.target_domain:
+            # The drive's members are read once and copied to the destination drive
+            totals['permission_lookups'] += 1
+            totals['permission_creates'] += self._member_creates(drive_id)
+        return {
+            'name': name,
+            'root_id': index.root_id,
+            'totals': totals,
+            'estimate': self._estimate(totals),
+            'items': list(index.items.values())
+        }
+
+    def _totals(self, index, shared_drive=False):
+        totals = {
+            'files': 0, 'folders': 0, 'shortcuts': 0, 'bytes': 0,
+            'exports': Counter(), 'download_chunks': 0, 'upload_chunks': 0,
+            'permission_creates': 0, 'permission_lookups': 0
+        }
+        workspace_formats = CONFIG['WORKSPACE_EXPORT_FORMATS']
+        for item in index.items.values():
+            mime_type = item['mimeType']
+            if mime_type == FOLDER_MIME_TYPE:
+                totals['folders'] += 1
+            elif mime_type == SHORTCUT_MIME_TYPE:
+                totals['shortcuts'] += 1
+                continue
+            elif mime_type in workspace_formats:
+                totals['files'] += 1
+                totals['exports'][mime_type] += 1
+                totals['upload_chunks'] += 1
+            else:
+                totals['files'] += 1
+                size = int(item.get('size') or item.get('quotaBytesUsed') or 0)
+                totals['bytes'] += size
+                # Spooled and ranged downloads alike send one request per DOWNLOAD_CHUNK_SIZE
+                totals['download_chunks'] += max(1, math.ceil(size / CONFIG['DOWNLOAD_CHUNK_SIZE']))
+                totals['upload_chunks'] += max(1, math.ceil(size / CONFIG['UPLOAD_CHUNK_SIZE']))
+
+            if not self.source_domain or not self.target_domain:
+                # No domain mapping, no permissions are migrated
+                continue
+            # Shared drive listings leave out item permissions, the run reads each item's own shares
+            permissions = None if shared_drive else inline_permissions(item)
+            if permissions is None:
+                # Missing or truncated in the listing, the run reads them with permissions().list
+                totals['permission_lookups'] += 1
+            else:
+                totals['permission_creates'] += sum(
+                    1 for permission in permissions
+                    if self.drive_manager._map_permission(permission, self.source_domain, self.target_domain)
+                )
+        totals['exports'] = dict(totals['exports'])
+        return totals
+
+    def _member_creates(self, drive_id):
+        """Member permissions of a shared drive the run will create on the destination drive"""
+        dm = self.drive_manager
+        permissions = dm._make_request(dm.source_service.permissions().list(
+            fileId=drive_id,
+            fields='permissions(emailAddress,role,type,domain)',
+            supportsAllDrives=True
+        )).get('permissions', [])
+        return sum(
+            1 for permission in permissions
+            if dm._map_permission(permission, self.source_domain, self.target_domain)
+        )
+
+    def _estimate(self, totals):
+        """API calls per endpoint class and seconds per phase for one source"""
+        items = totals['files'] + totals['folders'] + totals['shortcuts']
+        exports = sum(totals['exports'].values())
+        calls = {
+            'list': math.ceil(items / 1000) + 1,
+            # Download chunks on the source plus resumable upload chunks on the destination
+            'media': totals['download_chunks'] + totals['upload_chunks'],
+            'export': exports,
+            # Folder and shortcut creates
+            'write': totals['folders'] + totals['shortcuts'],
+            'permissions': totals['permission_creates'] + totals['permission_lookups']
+        }
+        throughput = CONFIG['PLAN_THROUGHPUT']
+        # Each account has its own media limiter
+        media_rate = self._call_rate('media')
+        seconds = {
+            'crawl': calls['list'] / self._call_rate('list'),
+            # Exports run in their own lane next to the binary downloads
+            'download': max(
+                totals['download_chunks'] / media_rate,
+                calls['export'] / self._call_rate('export'),
+                totals['bytes'] / throughput['download']
+            ),
+            'upload': max(
+                totals['upload_chunks'] / media_rate,
+                calls['write'] / self._call_rate('write'),
+                totals['bytes'] / throughput['upload']
+            ),
+            'permissions': calls['permissions'] / self._call_rate('permissions')
+        }
+        return {'api_calls': calls, 'exports': exports, 'bytes': totals['bytes'], 'seconds': seconds}
+
+    def _call_rate(self, endpoint):
+        """Sustained calls per second, bounded by the rate limit and by concurrency over call latency"""
+        rate, concurrency = CONFIG['RATE_LIMITS'].get(endpoint, CONFIG['RATE_LIMITS']['default'])
+        return min(rate, concurrency / CONFIG['PLAN_CALL_LATENCY'])
+
+    def _combine(self, estimates):
+        calls = Counter()
+        seconds = Counter()
+        size = 0
+        for estimate in estimates:
+            calls.update(estimate['api_calls'])
+            seconds.update(estimate['seconds'])
+            size += estimate['bytes']
+
+        # Uploads past the daily quota of the destination user wait for the next day
+        quota_days = max(1, math.ceil(size / CONFIG['DAILY_UPLOAD_LIMIT']))
+        staged = sum(seconds.values())
+        # Direct transfer overlaps download and upload
+        direct = seconds['crawl'] + max(seconds['download'], seconds['upload']) + seconds['permissions']
+        wait = (quota_days - 1) * 86400
+        return {
+            'api_calls': dict(calls),
+            'total_api_calls': sum(calls.values()),
+            'bytes': size,
+            'seconds': dict(seconds),
+            'staged_seconds': max(staged, wait),
+            'direct_seconds': max(direct, wait),
+            'upload_quota_days': quota_days
+        }
+
+    @staticmethod
+    def describe(plan):
+        """Human readable plan, one line per source plus the totals"""
+        lines = [f"=== Migration plan for {plan['source_email']} ==="]
+        for scope, source in plan['sources'].items():
+            totals = source['totals']
+            exports = ', '.join(
+                f"{count} {mime_type.rsplit('.', 1)[-1]}" for mime_type, count in sorted(totals['exports'].items())
+            ) or 'none'
+            label = f"{scope} ({source['name']})" if source['name'] else scope
+            lines.append(
+                f"{label}: {totals['files']} files, {totals['folders']} folders, {totals['shortcuts']} shortcuts, "
+                f"{totals['bytes'] / 1048576:.1f} MB, exports: {exports}, "
+                f"{totals['permission_creates']} permission creates"
+            )
+        estimate = plan['estimate']
+        calls = ', '.join(f"{endpoint} {count}" for endpoint, count in sorted(estimate['api_calls'].items()))
+        lines.append(f"API calls: {estimate['total_api_calls']} ({calls})")
+        lines.append(
+            f"Estimated duration: {timedelta(seconds=round(estimate['staged_seconds']))} staged, "
+            f"{timedelta(seconds=round(estimate['direct_seconds']))} direct transfer"
+        )
+        if estimate['upload_quota_days'] > 1:
+            lines.append(f"Needs {estimate['upload_quota_days']} days of the destination's daily upload quota")
+        return lines
@@ -0,0 +1,190 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import ssl
+import time
+import random
+import socket
+import logging
+import threading
+import googleapiclient.errors
+from config import CONFIG
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+TRANSIENT_ERRORS = (socket.timeout, socket.error, ConnectionError, ssl.SSLError)
+
+
+def is_throttled(error):
+    """True when Google asked us to slow down (429 or a 403 rate limit reason)"""
+    if not isinstance(error, googleapiclient.errors.HttpError):
+        return False
+    status = error.resp.status
+    if status == 429:
+        return True
+    return status == 403 and any(reason in str(error.content) for reason in RATE_LIMIT_REASONS)
+
+
+def is_retryable(error):
+    """True for errors that are worth sending again (throttling, server errors, dropped connections)"""
+    if isinstance(error, googleapiclient.errors.HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or is_throttled(error)
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, if it sent a Retry-After header"""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Token bucket plus a concurrency cap for one (account, endpoint class).
+
+    Both the request rate and the number of requests in flight are halved
+    whenever the API throttles us and grow back step by step as requests
+    succeed, so parallel workers settle just under the quota instead of
+    hammering it or sleeping longer than needed.
+    """
+
+    def __init__(self, name, rate, concurrency):
+        self.name = name
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.tokens = float(rate)
+        self.max_concurrency = concurrency
+        self.concurrency = concurrency
+        self.active = 0
+        self.successes = 0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                wait = self.paused_until - now
+                if wait <= 0 and self.active < self.concurrency:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.active += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, success=True):
+        with self.condition:
+            self.active -= 1
+            if success:
+                # Additive increase back towards the configured limits
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+                self.successes += 1
+                if self.concurrency < self.max_concurrency and self.successes >= self.concurrency:
+                    self.concurrency += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def throttle(self, delay):
+        """Multiplicative decrease after a rate limit response"""
+        with self.condition:
+            self.rate = max(self.max_rate / 32, self.rate / 2)
+            self.concurrency = max(1, self.concurrency // 2)
+            self.successes = 0
+            self.tokens = min(self.tokens, 0)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            logging.warning(
+                f"Throttled on {self.name}, backing off {delay:.1f}s "
+                f"(rate {self.rate:.1f}/s, concurrency {self.concurrency})"
+            )
+            self.condition.notify_all()
+
+
+class RequestExecutor:
+    """Single execution path for every Drive API call.
+
+    Requests are tagged with the account ('source' or 'dest') and an
+    endpoint class ('list', 'media', 'export', 'write', 'permissions') whose limits
+    come from CONFIG['RATE_LIMITS']. Retryable failures are retried with
+    full-jitter exponential backoff, honouring Retry-After, up to
+    CONFIG['MAX_REQUEST_ATTEMPTS'] attempts in total. Every attempt is
+    recorded in `metrics` when one is given.
+    """
+
+    def __init__(self, metrics=None):
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.metrics = metrics
+
+    def limiter(self, account, endpoint):
+        key = (account, endpoint)
+        with self.lock:
+            if key not in self.limiters:
+                rate, concurrency = CONFIG['RATE_LIMITS'].get(endpoint, CONFIG['RATE_LIMITS']['default'])
+                self.limiters[key] = AdaptiveLimiter(f"{account}/{endpoint}", rate, concurrency)
+            return self.limiters[key]
+
+    def execute(self, request, account, endpoint):
+        return self.call(lambda: request.execute(num_retries=0), account, endpoint)
+
+    def call(self, func, account, endpoint, max_attempts=None):
+        """Run func() under the limiter of (account, endpoint), retrying transient failures.
+
+        max_attempts=1 sends the request once, for callers that retry themselves.
+        """
+        limiter = self.limiter(account, endpoint)
+        max_attempts = max_attempts or CONFIG['MAX_REQUEST_ATTEMPTS']
+        attempt = 1
+        while True:
+            limiter.acquire()
+            start = time.monotonic()
+            success = False
+            try:
+                result = func()
+                success = True
+            except Exception as e:
+                error = e
+            finally:
+                # Also frees the slot on KeyboardInterrupt/SystemExit, which pass straight through
+                limiter.release(success=success)
+
+            if success:
+                self._record(account, endpoint, start, 'api_requests_total')
+                return result
+            self._record(account, endpoint, start, 'api_errors_total')
+            if not is_retryable(error) or attempt >= max_attempts:
+                raise error
+            delay = retry_after(error)
+            if delay is None:
+                delay = random.uniform(0, min(CONFIG['MAX_BACKOFF'], 2 ** attempt))
+            if is_throttled(error):
+                limiter.throttle(delay)
+                self._record(account, endpoint, None, 'api_throttled_total')
+            self._record(account, endpoint, None, 'api_retries_total')
+            logging.warning(f"Request failed on {account}/{endpoint}, retry {attempt} in {delay:.1f}s: {str(error)}")
+            time.sleep(delay)
+            attempt += 1
+
+    def _record(self, account, endpoint, start, counter):
+        if not self.metrics:
+            return
+        if start is not None:
+            self.metrics.observe('api_request_seconds', time.monotonic() - start, account=account, endpoint=endpoint)
+        self.metrics.count(counter, account=account, endpoint=endpoint)
+
+    def report_throttle(self, account, endpoint, delay=1.0):
+        """Let the limiter know about throttling seen outside call(), e.g. inside a batch"""
+        self.limiter(account, endpoint).throttle(delay)
+        self._record(account, endpoint, None, 'api_throttled_total')
@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+import googleapiclient.errors
+from drive_index import inline_permissions
+from config import CONFIG
+
+
+class CopyBlocked(Exception):
+    """The item cannot be copied server side and has to go through the host"""
+
+
+class ServerCopier:
+    """Copy source items into the destination drive with files().copy.
+
+    The destination account is given temporary read access to the source
+    item, copies it into the mapped destination folder and the grant is
+    revoked again, so no file bytes pass through the migration host and
+    Docs/Sheets/Slides stay in their native format. When the source domain
+    refuses to share with the destination account the copier turns itself
+    off for the rest of the run and callers fall back to download/upload.
+    """
+
+    def __init__(self, drive_manager, destination_email):
+        self.drive_manager = drive_manager
+        self.destination_email = destination_email
+        self.lock = threading.Lock()
+        self.disabled = False
+
+    def can_copy(self, item):
+        if self.disabled:
+            return False
+        mime_type = item['mimeType']
+        if mime_type.startswith('application/vnd.google-apps'):
+            return mime_type in CONFIG['WORKSPACE_EXPORT_FORMATS']
+        return True
+
+    def copy(self, item, name, parent_id):
+        """Copy one item and return the new file ID, raises CopyBlocked when it is not possible"""
+        if self.disabled:
+            raise CopyBlocked("server side copy disabled")
+        start = time.monotonic()
+        permission_id = self._grant(item)
+        try:
+            copied = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().copy(
+                fileId=item['id'],
+                body={'name': name, 'parents': [parent_id]},
+                fields='id',
+                supportsAllDrives=True
+            ))
+        except googleapiclient.errors.HttpError as e:
+            if e.resp.status in (403, 404):
+                raise CopyBlocked(str(e))
+            raise
+        finally:
+            if permission_id:
+                self._revoke(item, permission_id)
+        self.drive_manager.metrics.record_phase('copy', time.monotonic() - start, int(item.get('size') or 0))
+        return copied['id']
+
+    def _grant(self, item):
+        """Share the item with the destination account, returns None if it already has access"""
+        if self._has_access(item):
+            return None
+        try:
+            permission = self.drive_manager._make_request(
+                self.drive_manager.source_service.permissions().create(
+                    fileId=item['id'],
+                    body={'type': 'user', 'role': 'reader', 'emailAddress': self.destination_email},
+                    sendNotificationEmail=False,
+                    fields='id',
+                    supportsAllDrives=True
+                ),
+                'source', 'permissions'
+            )
+        except googleapiclient.errors.HttpError as e:
+            if e.resp.status != 403:
+                raise
+            # Sharing policy of the source domain, every other item would fail the same way
+            with self.lock:
+                if not self.disabled:
+                    logging.warning(f"Cannot share with {self.destination_email}, server side copy disabled: {str(e)}")
+                self.disabled = True
+            raise CopyBlocked(str(e))
+        return permission['id']
+
+    def _revoke(self, item, permission_id):
+        try:
+            self.drive_manager._make_request(
+                self.drive_manager.source_service.permissions().delete(
+                    fileId=item['id'],
+                    permissionId=permission_id,
+                    supportsAllDrives=True
+                ),
+                'source', 'permissions'
+            )
+        except Exception as e:
+            logging.error(f"Failed to revoke temporary access {permission_id} on {item['id']}: {str(e)}")
+
+    def _has_access(self, item):
+        permissions = inline_permissions(item)
+        if permissions is None:
+            response = self.drive_manager._make_request(
+                self.drive_manager.source_service.permissions().list(
+                    fileId=item['id'],
+                    fields='permissions(emailAddress)',
+                    supportsAllDrives=True
+                ),
+                'source', 'permissions'
+            )
+            permissions = response.get('permissions', [])
+        email = self.destination_email.lower()
+        return any((permission.get('emailAddress') or '').lower() == email for permission in permissions)
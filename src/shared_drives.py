@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+from stream_transfer import StreamTransfer
+from config import CONFIG
+
+
+def dest_drive_key(source_drive_id):
+    return f'shared_drive_dest:{source_drive_id}'
+
+
+class SharedDriveMigrator:
+    """Transfer every shared drive of the source user into the destination.
+
+    All drives are enumerated (drives().list is paged) and each one is
+    crawled with a single corpora='drive' listing, then streamed into its
+    own destination shared drive by StreamTransfer's download and upload
+    pools. Up to CONFIG['SHARED_DRIVE_WORKERS'] drives run at once; API
+    calls still go through the drive manager's shared rate limiter, so the
+    cap bounds memory and threads, not quota.
+
+    The destination drive of each source drive is kept in the state store
+    and a drive whose stream checkpoint is complete is skipped, so a rerun
+    picks up where the last one stopped. Members are migrated on the
+    drive itself and items inherit them; only the shares added on an item
+    itself are copied to the item.
+    """
+
+    def __init__(self, drive_manager, destination_email, source_domain=None, target_domain=None):
+        self.drive_manager = drive_manager
+        self.state = drive_manager.state
+        self.destination_email = destination_email
+        self.source_domain = source_domain
+        self.target_domain = target_domain
+
+    def run(self):
+        """Migrate all drives, returns the names of the ones that failed.
+
+        Raises when the drives cannot be listed.
+        """
+        drives = self.drive_manager.list_shared_drives(self.drive_manager.source_email)
+        failed = []
+        with ThreadPoolExecutor(max_workers=CONFIG['SHARED_DRIVE_WORKERS']) as executor:
+            futures = {executor.submit(self._migrate_drive, drive): drive for drive in drives}
+            for future in as_completed(futures):
+                drive = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Shared drive {drive['name']} failed: {str(e)}")
+                    failed.append(drive['name'])
+
+        self.drive_manager.permission_batcher.flush()
+        self.state.flush()
+        logging.info(f"Migrated {len(drives) - len(failed)} of {len(drives)} shared drives")
+        return failed
+
+    def _migrate_drive(self, drive):
+        scope = f"shared_drive:{drive['id']}"
+        checkpoint = self.state.checkpoint(scope, 'stream')
+        if checkpoint and checkpoint['status'] == 'complete':
+            logging.info(f"Shared drive {drive['name']} already migrated, skipping")
+            return
+
+        self.state.record_checkpoint(scope, 'stream', 'running')
+        index = self.drive_manager.build_shared_drive_index(drive['id'])
+        files = index.count_files()
+        with self.drive_manager.progress_lock:
+            self.drive_manager.total_files += files
+
+        dest_drive_id = self._dest_drive(drive)
+        self._migrate_members(drive, dest_drive_id)
+        logging.info(f"Transferring shared drive {drive['name']} ({files} files)")
+        StreamTransfer(
+            self.drive_manager, self.destination_email, self.source_domain, self.target_domain, scope=scope
+        ).run(index, dest_parent_id=dest_drive_id)
+        self.state.record_checkpoint(scope, 'stream', 'complete', files)
+        logging.info(f"Shared drive {drive['name']} migrated")
+
+    def _dest_drive(self, drive):
+        """Destination shared drive for a source drive, created on the first run"""
+        key = dest_drive_key(drive['id'])
+        dest_drive_id = self.state.get_meta(key)
+        if not dest_drive_id:
+            dest_drive_id = self.drive_manager.create_shared_drive(drive['name'])
+            self.state.set_meta(key, dest_drive_id)
+        return dest_drive_id
+
+    def _migrate_members(self, drive, dest_drive_id):
+        if self.source_domain and self.target_domain:
+            self.drive_manager._migrate_sharing_permissions(
+                drive['id'], dest_drive_id, self.source_domain, self.target_domain
+            )
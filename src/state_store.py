@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from drive_index import FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE
+from config import CONFIG
+
+
+class StateStore:
+    """Crash-safe SQLite store for per-item migration state.
+
+    One row per item keyed by its scope (which drive the item belongs to,
+    e.g. 'my_drive') and its path relative to that drive's root, holding
+    the source ID, destination ID, size, checksum and the last phase the
+    item completed. The database runs in WAL mode and writes are committed
+    in batches (every CONFIG['STATE_COMMIT_BATCH'] writes or
+    CONFIG['STATE_COMMIT_INTERVAL'] seconds), so bookkeeping stays cheap on
+    drives with hundreds of thousands of files. The connection is shared by
+    all worker threads behind a lock.
+    """
+
+    COLUMNS = ('source_id', 'dest_id', 'size', 'md5_checksum', 'mime_type', 'phase', 'permissions', 'source_version', 'target_id')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                scope TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                source_id TEXT,
+                dest_id TEXT,
+                size INTEGER,
+                md5_checksum TEXT,
+                mime_type TEXT,
+                phase TEXT,
+                permissions TEXT,
+                source_version TEXT,
+                target_id TEXT,
+                updated_at REAL,
+                PRIMARY KEY (scope, rel_path)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                scope TEXT NOT NULL,
+                rel_path TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                progress INTEGER NOT NULL,
+                size INTEGER,
+                content_version TEXT,
+                updated_at REAL,
+                PRIMARY KEY (scope, rel_path)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                scope TEXT NOT NULL,
+                phase TEXT NOT NULL,
+                status TEXT NOT NULL,
+                items INTEGER,
+                archive_path TEXT,
+                updated_at REAL,
+                PRIMARY KEY (scope, phase)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        existing = {row['name'] for row in self.conn.execute('PRAGMA table_info(items)')}
+        for column in self.COLUMNS:
+            if column not in existing:
+                # Store created by an older version
+                self.conn.execute(f'ALTER TABLE items ADD COLUMN {column}')
+        sessions = {row['name'] for row in self.conn.execute('PRAGMA table_info(upload_sessions)')}
+        if 'content_version' not in sessions:
+            self.conn.execute('ALTER TABLE upload_sessions ADD COLUMN content_version TEXT')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_items_source_id ON items(source_id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_items_phase ON items(scope, phase)')
+        self.conn.commit()
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+
+    def record(self, scope, rel_path, **fields):
+        """Insert or update an item, only touching the columns given"""
+        unknown = set(fields) - set(self.COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown state columns: {', '.join(sorted(unknown))}")
+        if fields.get('permissions') is not None:
+            fields['permissions'] = json.dumps(fields['permissions'])
+
+        columns = ['scope', 'rel_path', *fields, 'updated_at']
+        values = [scope, rel_path, *fields.values(), time.time()]
+        updates = ', '.join(f"{column}=excluded.{column}" for column in columns[2:])
+        with self.lock:
+            self.conn.execute(
+                f"INSERT INTO items ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                f"ON CONFLICT(scope, rel_path) DO UPDATE SET {updates}",
+                values
+            )
+            self.pending_writes += 1
+            self._maybe_commit()
+
+    def _maybe_commit(self):
+        if (self.pending_writes >= CONFIG['STATE_COMMIT_BATCH'] or
+                time.monotonic() - self.last_commit >= CONFIG['STATE_COMMIT_INTERVAL']):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.pending_writes:
+                self.conn.commit()
+                self.pending_writes = 0
+            self.last_commit = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+    def get(self, scope, rel_path):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM items WHERE scope = ? AND rel_path = ?', (scope, rel_path)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def source_id_for(self, scope, rel_path):
+        item = self.get(scope, rel_path)
+        return item['source_id'] if item else None
+
+    def item_for_source(self, scope, source_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM items WHERE scope = ? AND source_id = ?', (scope, source_id)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, scope, rel_path):
+        with self.lock:
+            self.conn.execute('DELETE FROM items WHERE scope = ? AND rel_path = ?', (scope, rel_path))
+            self.pending_writes += 1
+            self._maybe_commit()
+
+    def move_tree(self, scope, old_path, new_path):
+        """Rewrite the paths of an item and everything below it after a folder moved"""
+        prefix = old_path + os.sep
+        with self.lock:
+            self.conn.execute(
+                'UPDATE items SET rel_path = ? || substr(rel_path, ?) '
+                'WHERE scope = ? AND (rel_path = ? OR substr(rel_path, 1, ?) = ?)',
+                (new_path, len(old_path) + 1, scope, old_path, len(prefix), prefix)
+            )
+            self.pending_writes += 1
+            self._maybe_commit()
+
+    def record_checkpoint(self, scope, phase, status, items=None, archive_path=None):
+        """Mark a phase (download, upload, stream) of a scope as running or complete, committed right away"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO checkpoints (scope, phase, status, items, archive_path, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (scope, phase, status, items, archive_path, time.time())
+            )
+            self.pending_writes += 1
+            self.flush()
+
+    def checkpoint(self, scope, phase):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT * FROM checkpoints WHERE scope = ? AND phase = ?', (scope, phase)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        """Store a run-level value (e.g. a changes page token), committed right away"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+            self.pending_writes += 1
+            self.flush()
+
+    def source_item(self, scope, rel_path):
+        """(source_id, permissions) of an item, permissions is None when not known"""
+        item = self.get(scope, rel_path)
+        if not item:
+            return None, None
+        permissions = json.loads(item['permissions']) if item['permissions'] is not None else None
+        return item['source_id'], permissions
+
+    def dest_id_for_source(self, source_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT dest_id FROM items WHERE source_id = ? AND dest_id IS NOT NULL',
+                (source_id,)
+            ).fetchone()
+        return row['dest_id'] if row else None
+
+    def paths_in_phase(self, scope, phase):
+        """Map rel_path -> dest_id for every item of a scope that reached a phase"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT rel_path, dest_id FROM items WHERE scope = ? AND phase = ?', (scope, phase)
+            ).fetchall()
+        return {row['rel_path']: row['dest_id'] for row in rows}
+
+    def items_in_phase(self, scope, phase, mime_type):
+        """Every item of one MIME type in a scope that reached a phase, e.g. shortcuts still to create"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT * FROM items WHERE scope = ? AND phase = ? AND mime_type = ?', (scope, phase, mime_type)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def source_ids_in_phase(self, scope, phase):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source_id FROM items WHERE scope = ? AND phase = ? AND source_id IS NOT NULL',
+                (scope, phase)
+            ).fetchall()
+        return {row['source_id'] for row in rows}
+
+    def file_mapping(self):
+        """Source ID -> destination ID for everything migrated so far"""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT source_id, dest_id FROM items WHERE source_id IS NOT NULL AND dest_id IS NOT NULL'
+            ).fetchall()
+        return {row['source_id']: row['dest_id'] for row in rows}
+
+    def upload_session(self, scope, rel_path):
+        """Resumable upload session left behind by an interrupted upload, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT uri, progress, size, content_version FROM upload_sessions WHERE scope = ? AND rel_path = ?',
+                (scope, rel_path)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def record_upload_session(self, scope, rel_path, uri, progress, size, content_version=None):
+        """Save the session and confirmed offset of an upload, committed right away"""
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO upload_sessions '
+                '(scope, rel_path, uri, progress, size, content_version, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (scope, rel_path, uri, progress, size, content_version, time.time())
+            )
+            self.pending_writes += 1
+            self.flush()
+
+    def clear_upload_session(self, scope, rel_path):
+        with self.lock:
+            self.conn.execute(
+                'DELETE FROM upload_sessions WHERE scope = ? AND rel_path = ?', (scope, rel_path)
+            )
+            self.pending_writes += 1
+            self._maybe_commit()
+
+    def count_files(self, scope, phase):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM items WHERE scope = ? AND phase = ? AND (mime_type IS NULL OR mime_type NOT IN (?, ?))',
+                (scope, phase, FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE)
+            ).fetchone()[0]
+
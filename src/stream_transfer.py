@@ -0,0 +1,378 @@
+from googleapiclient.http import MediaIoBaseUpload
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import logging
+import threading
+from drive_index import FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE, inline_permissions
+from server_copy import ServerCopier, CopyBlocked
+from config import CONFIG
+
+
+class StreamTransfer:
+    """Copy a source folder tree straight into the destination drive.
+
+    The calling thread only walks the source tree. Files download on
+    CONFIG['DOWNLOAD_WORKERS'] threads and upload on CONFIG['UPLOAD_WORKERS']
+    threads, so uploads start as soon as the first file is in. Each file is
+    held in a spooled buffer that only spills to disk above
+    CONFIG['SPOOL_MAX_MEMORY'], and the queue between the two sides is
+    bounded, so downloads wait for the uploaders and memory use stays flat.
+
+    Folders are created in walk order on a thread of their own, parents
+    before children; a file's upload waits until its folder exists.
+    Workspace exports run on their own CONFIG['EXPORT_WORKERS'] threads, so
+    the downloads do not wait on them.
+
+    With CONFIG['SERVER_SIDE_COPY'] set, files are copied by the
+    destination account on a pool of CONFIG['COPY_WORKERS'] threads
+    instead, and only the ones that cannot be copied are downloaded.
+
+    Items already in the destination (per the drive manager's destination
+    index) are not sent again: identical files are skipped before they are
+    downloaded, changed ones updated in place and folders reused.
+    """
+
+    def __init__(self, drive_manager, destination_email, source_domain=None, target_domain=None, scope='my_drive'):
+        self.drive_manager = drive_manager
+        self.destination_email = destination_email
+        self.source_domain = source_domain
+        self.target_domain = target_domain
+        self.queue = queue.Queue(maxsize=CONFIG['STREAM_QUEUE_SIZE'])
+        self.folders = queue.Queue()
+        self.folder_ids = {}
+        # Set once a folder's destination ID is known, or its creation failed
+        self.folder_ready = {}
+        self.error = None
+        self.scope = scope
+        self.shortcuts = []
+        self.copier = ServerCopier(drive_manager, destination_email) if CONFIG['SERVER_SIDE_COPY'] else None
+        self.copy_pool = None
+        self.download_pool = None
+        self.export_pool = None
+        # Files finished and folders created by an earlier run
+        self.transferred = drive_manager.state.source_ids_in_phase(scope, 'uploaded')
+        self.created_folders = drive_manager.state.paths_in_phase(scope, 'uploaded')
+
+    def run(self, index, source_folder_id=None, dest_parent_id='root'):
+        self.folder_ids[''] = dest_parent_id
+        self.folder_ready[''] = threading.Event()
+        self.folder_ready[''].set()
+        if self.copier:
+            self.copy_pool = ThreadPoolExecutor(max_workers=CONFIG['COPY_WORKERS'], thread_name_prefix='copy')
+        self.download_pool = ThreadPoolExecutor(max_workers=CONFIG['DOWNLOAD_WORKERS'], thread_name_prefix='download')
+        self.export_pool = ThreadPoolExecutor(max_workers=CONFIG['EXPORT_WORKERS'], thread_name_prefix='export')
+        folder_worker = threading.Thread(target=self._folder_worker, name='folders', daemon=True)
+        folder_worker.start()
+        uploaders = [
+            threading.Thread(target=self._upload_worker, name=f'upload-{i}', daemon=True)
+            for i in range(CONFIG['UPLOAD_WORKERS'])
+        ]
+        for uploader in uploaders:
+            uploader.start()
+        try:
+            self._stream_tree(index, source_folder_id)
+        finally:
+            self.folders.put(None)
+            # Pending downloads, exports and copies still queue or send their uploads
+            self.download_pool.shutdown(wait=True)
+            self.export_pool.shutdown(wait=True)
+            if self.copy_pool:
+                self.copy_pool.shutdown(wait=True)
+            for _ in uploaders:
+                self.queue.put(None)
+            for uploader in uploaders:
+                uploader.join()
+            folder_worker.join()
+
+        if self.error:
+            raise self.error
+        self._create_shortcuts()
+        return True
+
+    def _stream_tree(self, index, source_folder_id):
+        for item, folder_path in index.walk(source_folder_id):
+            if self.error:
+                return
+            try:
+                if item['mimeType'] == FOLDER_MIME_TYPE:
+                    new_path = os.path.join(folder_path, self.drive_manager._clean_filename(item['name']))
+                    self.folder_ready[new_path] = threading.Event()
+                    self.folders.put((item, new_path))
+                elif item['id'] in self.transferred:
+                    logging.info(f"Skipping already transferred: {item['name']}")
+                elif item['mimeType'] == SHORTCUT_MIME_TYPE:
+                    # Created once the whole tree is in, so targets moved along with it can be mapped
+                    self.shortcuts.append((item, folder_path))
+                elif self._skip_identical(item, folder_path):
+                    continue
+                elif self._can_copy(item, folder_path):
+                    self.copy_pool.submit(self._copy_file, item, folder_path)
+                elif item['mimeType'] in CONFIG['WORKSPACE_EXPORT_FORMATS']:
+                    self.export_pool.submit(self._fetch_item, item, folder_path)
+                else:
+                    self.download_pool.submit(self._fetch_item, item, folder_path)
+            except Exception as e:
+                logging.error(f"Error streaming {item['name']}: {str(e)}")
+                continue
+
+    def _can_copy(self, item, folder_path):
+        if not self.copier or not self.copier.can_copy(item):
+            return False
+        # Copying next to an outdated version would leave a duplicate, those are updated in place
+        return not self._existing(os.path.join(folder_path, self._dest_name(item)))
+
+    def _dest_name(self, item):
+        """Name an item gets in the destination, server side copies keep the native format"""
+        name = self.drive_manager._clean_filename(item['name'])
+        export = CONFIG['WORKSPACE_EXPORT_FORMATS'].get(item['mimeType'])
+        if not export or (self.copier and self.copier.can_copy(item)):
+            return name
+        return f"{name}{export[1]}"
+
+    def _existing(self, path, folder=False):
+        """Item the destination held at path before this run, only known below My Drive root"""
+        dest_index = self.drive_manager.dest_index
+        if not dest_index or self.folder_ids.get('') != 'root':
+            return None
+        return dest_index.find_path(path, folder)
+
+    def _skip_identical(self, item, folder_path):
+        """Record and skip a file the destination already has, without downloading it"""
+        path = os.path.join(folder_path, self._dest_name(item))
+        existing = self._existing(path)
+        if not existing:
+            return False
+        if item.get('md5Checksum'):
+            identical = (item['md5Checksum'] == existing.get('md5Checksum') and
+                         item.get('size') == existing.get('size'))
+        else:
+            # Exports differ byte for byte every time, trust a destination copy written after the last edit
+            identical = existing.get('modifiedTime', '') >= item.get('modifiedTime', '~')
+        if not identical:
+            return False
+
+        self._migrate_permissions(item, existing['id'])
+        self.drive_manager._store_file_mapping(
+            self.scope, path, item['id'], existing['id'],
+            size=item.get('size'),
+            md5_checksum=item.get('md5Checksum'),
+            mime_type=item['mimeType'],
+            source_version=self.drive_manager.source_version(item)
+        )
+        self._report(os.path.basename(path), "Skipping")
+        logging.info(f"Already in destination, skipping: {path}")
+        return True
+
+    def _download_item(self, item, folder_path):
+        """Download or export one file into a spooled buffer"""
+        name = self.drive_manager._clean_filename(item['name'])
+        if item['mimeType'].startswith('application/vnd.google-apps'):
+            workspace_formats = CONFIG['WORKSPACE_EXPORT_FORMATS']
+            if item['mimeType'] not in workspace_formats:
+                return None
+            mime_type, extension = workspace_formats[item['mimeType']]
+            buffer = self.drive_manager.export_cache.export(item, mime_type)
+            name = f"{name}{extension}"
+        else:
+            mime_type = item['mimeType']
+            buffer = self.drive_manager._download_media(item)
+
+        logging.info(f"Downloaded: {os.path.join(folder_path, name)}")
+        return name, mime_type, buffer
+
+    def _fetch_item(self, item, folder_path):
+        """Download or export on a pool worker, then wait for room in the upload queue"""
+        if self.error:
+            return
+        try:
+            payload = self._download_item(item, folder_path)
+            if payload:
+                self.queue.put((item, folder_path, payload))
+        except Exception as e:
+            logging.error(f"Error downloading {item['name']}: {str(e)}")
+
+    def _folder_worker(self):
+        while True:
+            job = self.folders.get()
+            if job is None:
+                break
+            item, path = job
+            try:
+                if not self.error:
+                    self._create_folder(item, path)
+            except Exception as e:
+                # Nothing below this folder can be placed, stop the walk
+                logging.error(f"Error creating folder {path}: {str(e)}")
+                self.error = e
+            finally:
+                self.folder_ready[path].set()
+
+    def _folder_id(self, path):
+        """Destination ID of a folder once it exists, None when it could not be created"""
+        self.folder_ready[path].wait()
+        return self.folder_ids.get(path)
+
+    def _upload_worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            item, path, payload = job
+            try:
+                if not self.error:
+                    self._upload_file(item, path, payload)
+            except Exception as e:
+                logging.error(f"Error uploading {item['name']}: {str(e)}")
+            finally:
+                payload[2].close()
+
+    def _create_folder(self, item, path):
+        if self.created_folders.get(path):
+            self.folder_ids[path] = self.created_folders[path]
+            return
+        existing = self._existing(path, folder=True)
+        if existing:
+            logging.info(f"Reusing existing folder: {path}")
+            self._record_folder(item, path, existing['id'])
+            return
+
+        folder_metadata = {
+            'name': os.path.basename(path),
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [self.folder_ids[os.path.dirname(path)]]
+        }
+        folder = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+            body=folder_metadata,
+            fields='id',
+            supportsAllDrives=True
+        ))
+        self._record_folder(item, path, folder['id'])
+
+    def _record_folder(self, item, path, folder_id):
+        self.folder_ids[path] = folder_id
+        self.drive_manager._store_file_mapping(
+            self.scope, path, item['id'], folder_id, mime_type=FOLDER_MIME_TYPE
+        )
+        self._migrate_permissions(item, folder_id)
+
+    def _create_shortcuts(self):
+        """Recreate the tree's shortcuts in their mapped folders of this destination drive"""
+        for item, folder_path in self.shortcuts:
+            try:
+                target_id = item['shortcutDetails']['targetId']
+                # Point at the migrated copy of the target when there is one
+                target_id = self.drive_manager.state.dest_id_for_source(target_id) or target_id
+                shortcut = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+                    body={
+                        'name': item['name'],
+                        'mimeType': SHORTCUT_MIME_TYPE,
+                        'shortcutDetails': {'targetId': target_id},
+                        'parents': [self.folder_ids[folder_path]]
+                    },
+                    fields='id',
+                    supportsAllDrives=True
+                ))
+                self.drive_manager._store_file_mapping(
+                    self.scope,
+                    os.path.join(folder_path, self.drive_manager._clean_filename(item['name'])),
+                    item['id'],
+                    shortcut['id'],
+                    mime_type=SHORTCUT_MIME_TYPE
+                )
+                logging.info(f"Recreated shortcut: {item['name']}")
+            except Exception as e:
+                logging.error(f"Error recreating shortcut {item['name']}: {str(e)}")
+
+    def _copy_file(self, item, folder_path):
+        name = self.drive_manager._clean_filename(item['name'])
+        try:
+            parent_id = self._folder_id(folder_path)
+            if parent_id is None:
+                return
+            try:
+                dest_id = self.copier.copy(item, name, parent_id)
+            except CopyBlocked as e:
+                logging.info(f"Server side copy not possible for {item['name']}, transferring through host: {str(e)}")
+                payload = self._download_item(item, folder_path)
+                if payload:
+                    try:
+                        self._upload_file(item, folder_path, payload)
+                    finally:
+                        payload[2].close()
+                return
+
+            self._migrate_permissions(item, dest_id)
+            self.drive_manager._store_file_mapping(
+                self.scope,
+                os.path.join(folder_path, name),
+                item['id'],
+                dest_id,
+                size=item.get('size'),
+                md5_checksum=item.get('md5Checksum'),
+                mime_type=item['mimeType'],
+                source_version=self.drive_manager.source_version(item)
+            )
+            self._report(name, "Copying")
+            logging.info(f"Copied: {os.path.join(folder_path, name)}")
+        except Exception as e:
+            logging.error(f"Error copying {item['name']}: {str(e)}")
+
+    def _report(self, name, action):
+        with self.drive_manager.progress_lock:
+            self.drive_manager.current_file_count += 1
+        if hasattr(self.drive_manager, 'ui'):
+            self.drive_manager.ui.update_transfer_info(
+                name,
+                action,
+                self.drive_manager.current_file_count,
+                self.drive_manager.total_files
+            )
+
+    def _upload_file(self, item, folder_path, payload):
+        name, mime_type, buffer = payload
+        media = MediaIoBaseUpload(
+            buffer,
+            mimetype=mime_type,
+            chunksize=CONFIG['UPLOAD_CHUNK_SIZE'],
+            resumable=True
+        )
+        parent_id = self._folder_id(folder_path)
+        if parent_id is None:
+            raise IOError(f"Folder {folder_path} could not be created")
+        files = self.drive_manager.dest_service.files()
+        existing = self._existing(os.path.join(folder_path, name))
+        if existing:
+            # Same name, different content: replace it instead of adding a duplicate
+            request = files.update(fileId=existing['id'], media_body=media, fields='id', supportsAllDrives=True)
+        else:
+            request = files.create(
+                body={'name': name, 'parents': [parent_id]},
+                media_body=media,
+                fields='id',
+                supportsAllDrives=True
+            )
+        uploaded_file = self.drive_manager._resumable_upload(
+            request, self.scope, os.path.join(folder_path, name), self.drive_manager.content_version(item)
+        )
+        self._migrate_permissions(item, uploaded_file['id'])
+        self.drive_manager._store_file_mapping(
+            self.scope,
+            os.path.join(folder_path, name),
+            item['id'],
+            uploaded_file['id'],
+            size=item.get('size'),
+            md5_checksum=item.get('md5Checksum'),
+            mime_type=item['mimeType'],
+            source_version=self.drive_manager.source_version(item)
+        )
+
+        self._report(name, "Streaming")
+        logging.info(f"Uploaded: {os.path.join(folder_path, name)}")
+
+    def _migrate_permissions(self, item, dest_id):
+        if self.source_domain and self.target_domain:
+            self.drive_manager._migrate_sharing_permissions(
+                item['id'], dest_id, self.source_domain, self.target_domain,
+                inline_permissions(item)
+            )
@@ -0,0 +1,86 @@
+from googleapiclient.discovery import build
+import threading
+import httplib2
+import google.auth.credentials
+import google_auth_httplib2
+
+
+class SharedCredentials(google.auth.credentials.Credentials):
+    """OAuth credentials shared by every thread of one account.
+
+    google-auth credentials are not safe to refresh from several threads at
+    once, so refreshes are serialized, and a thread that waited while
+    another one refreshed reuses the new token instead of refreshing again.
+
+    It is a google-auth Credentials itself, because googleapiclient only
+    checks and refreshes credentials of that type before a batch request;
+    anything else is treated as oauth2client credentials.
+    """
+
+    def __init__(self, credentials):
+        # Token and expiry stay on the wrapped credentials, the base initializer is not used
+        self.credentials = credentials
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Quota project, universe domain and the like come from the wrapped credentials
+        if name == 'credentials':
+            raise AttributeError(name)
+        return getattr(self.credentials, name)
+
+    @property
+    def token(self):
+        return self.credentials.token
+
+    @property
+    def expired(self):
+        return self.credentials.expired
+
+    @property
+    def expiry(self):
+        return self.credentials.expiry
+
+    @property
+    def valid(self):
+        return self.credentials.valid
+
+    def refresh(self, request):
+        stale_token = self.credentials.token
+        with self.lock:
+            if self.credentials.token == stale_token:
+                self.credentials.refresh(request)
+
+    def apply(self, headers, token=None):
+        self.credentials.apply(headers, token)
+
+    def before_request(self, request, method, url, headers):
+        if not self.credentials.valid:
+            self.refresh(request)
+        self.apply(headers)
+
+
+class Transport:
+    """Authorized HTTP connections for one account, one per thread.
+
+    httplib2.Http is not thread-safe, so each thread gets its own
+    connection, kept alive between requests, over the account's shared
+    credentials. Certificates are verified as usual.
+    """
+
+    def __init__(self, credentials, timeout=None):
+        self.credentials = SharedCredentials(credentials)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def http(self):
+        if not hasattr(self.local, 'http'):
+            self.local.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=self.connection())
+        return self.local.http
+
+    def connection(self):
+        """Plain keep-alive connection under the authorized wrapper"""
+        return httplib2.Http(timeout=self.timeout)
+
+    def build_service(self):
+        """Drive service over the calling thread's connection, build once per thread and reuse it"""
+        return build('drive', 'v3', http=self.http(), cache_discovery=False)
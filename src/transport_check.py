@@ -0,0 +1,89 @@
+"""Offline check of the transport against the real googleapiclient batch path.
+
+The benchmark builds its services through fake_drive, so Transport and
+SharedCredentials never see a request there. This script builds a real
+Drive service on a Transport whose connection is an httplib2 mock,
+then runs a one-entry permissions batch the way PermissionBatcher does,
+once with a valid token and once with an expired one, e.g.
+
+    python transport_check.py
+"""
+from datetime import datetime, timedelta
+import sys
+import json
+from googleapiclient.http import HttpMockSequence
+import google.oauth2.credentials
+from transport import Transport
+
+BOUNDARY = 'batch_check'
+
+
+class CountingCredentials(google.oauth2.credentials.Credentials):
+    """OAuth credentials whose refresh hands out a new token without calling the token endpoint"""
+
+    refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+class MockTransport(Transport):
+    """Transport whose connection answers every request with one batch response"""
+
+    def connection(self):
+        return HttpMockSequence([({'status': '200', 'content-type': f'multipart/mixed; boundary="{BOUNDARY}"'},
+                                  batch_response())])
+
+
+def batch_response():
+    body = json.dumps({'permissions': [{'id': 'p1', 'type': 'user', 'role': 'reader'}]})
+    return (
+        f'--{BOUNDARY}\r\n'
+        'Content-Type: application/http\r\n'
+        'Content-ID: <response-check + p1>\r\n\r\n'
+        'HTTP/1.1 200 OK\r\n'
+        'Content-Type: application/json\r\n\r\n'
+        f'{body}\r\n'
+        f'--{BOUNDARY}--\r\n'
+    )
+
+
+def run_batch(expiry):
+    credentials = CountingCredentials(token='token-0', expiry=expiry)
+    service = MockTransport(credentials).build_service()
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = exception or response
+
+    batch = service.new_batch_http_request(callback=callback)
+    batch.add(service.permissions().list(fileId='file', supportsAllDrives=True), request_id='p1')
+    batch.execute()
+    result = results.get('p1')
+    if not isinstance(result, dict) or result['permissions'][0]['id'] != 'p1':
+        raise AssertionError(f"Unexpected batch result: {result!r}")
+    return credentials.refreshes
+
+
+def main():
+    checks = [
+        ('valid token', datetime.utcnow() + timedelta(hours=1), 0),
+        ('expired token', datetime.utcnow() - timedelta(minutes=1), 1)
+    ]
+    failed = False
+    for name, expiry, expected_refreshes in checks:
+        try:
+            refreshes = run_batch(expiry)
+            if refreshes != expected_refreshes:
+                raise AssertionError(f"{refreshes} refreshes, expected {expected_refreshes}")
+            print(f"{name}: ok, {refreshes} refreshes")
+        except Exception as e:
+            failed = True
+            print(f"{name}: FAILED, {type(e).__name__}: {str(e)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 from drive_manager import DriveManager
-import logging
+from planner import MigrationPlanner
 import threading
-import os
+import queue
 from config import CONFIG
 
 class MigrationUI:
@@ -44,6 +44,13 @@ class MigrationUI:
         ttk.Checkbutton(self.migration_options, text="My Drive", variable=self.my_drive_var).grid(row=0, column=0, padx=5)
         ttk.Checkbutton(self.migration_options, text="Shared Drives", variable=self.shared_drive_var).grid(row=0, column=1, padx=5)
         ttk.Checkbutton(self.migration_options, text="Shared with me", variable=self.shared_with_me_var).grid(row=0, column=2, padx=5)
+
+        self.direct_transfer_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.migration_options, text="Direct transfer (no ZIP staging)", variable=self.direct_transfer_var).grid(row=1, column=0, columnspan=3, padx=5)
+        self.delta_sync_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.migration_options, text="Only sync My Drive changes since last run", variable=self.delta_sync_var).grid(row=2, column=0, columnspan=3, padx=5)
+        self.plan_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.migration_options, text="Dry run: only estimate size and duration", variable=self.plan_only_var).grid(row=3, column=0, columnspan=3, padx=5)
         
         # Progress bar
         self.progress = ttk.Progressbar(self.main_frame, length=300, mode='indeterminate')
@@ -118,19 +125,54 @@ class MigrationUI:
         # Force update display
         self.root.update_idletasks()
 
+        # Worker threads never touch widgets, they publish here and the Tk loop applies it on a timer
+        self.events = queue.Queue()
+        self.transfer_lock = threading.Lock()
+        self.latest_transfer = None
+        self.root.after(CONFIG['UI_REFRESH_MS'], self._drain_events)
+
+    def _post(self, func):
+        """Run func on the Tk thread at the next refresh"""
+        self.events.put(('call', func))
+
+    def _drain_events(self):
+        """Apply everything published since the last tick in a single repaint"""
+        messages = []
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'status':
+                messages.append(payload)
+            else:
+                payload()
+        if messages:
+            self.status_text.insert(tk.END, ''.join(f"{message}\n" for message in messages))
+            self.status_text.see(tk.END)
+
+        with self.transfer_lock:
+            transfer, self.latest_transfer = self.latest_transfer, None
+        if transfer:
+            self._show_transfer_info(*transfer)
+        self.root.after(CONFIG['UI_REFRESH_MS'], self._drain_events)
+
     def update_transfer_info(self, file_name, transfer_type, current_count, total_count):
-        """Update transfer information in UI"""
+        """Publish transfer progress, safe from any thread; only the latest one per refresh is shown"""
+        with self.transfer_lock:
+            self.latest_transfer = (file_name, transfer_type, current_count, total_count)
+
+    def _show_transfer_info(self, file_name, transfer_type, current_count, total_count):
         status_text = transfer_type
         if transfer_type == "Downloading" and file_name.endswith('.shortcut'):
             status_text += " (Shortcut)"
         self.current_file_label.config(text=f"Current File: {file_name}")
         self.transfer_type_label.config(text=f"Status: {status_text}")
         self.file_count_label.config(text=f"Files: {current_count}/{total_count}")
-        self.root.update()
 
     def update_status(self, message):
-        self.status_text.insert(tk.END, f"{message}\n")
-        self.status_text.see(tk.END)
+        """Publish a status line, safe from any thread"""
+        self.events.put(('status', message))
 
     def start_migration(self):
         source = self.source_email.get()
@@ -142,9 +184,20 @@ class MigrationUI:
             messagebox.showerror("Error", "Please fill in all required fields")
             return
         
+        # Read the options here, Tk variables belong to this thread
+        options = {
+            'my_drive': self.my_drive_var.get(),
+            'shared_drive': self.shared_drive_var.get(),
+            'shared_with_me': self.shared_with_me_var.get(),
+            'direct_transfer': self.direct_transfer_var.get(),
+            'delta_sync': self.delta_sync_var.get(),
+            'plan_only': self.plan_only_var.get()
+        }
+
         self.progress.start()
         self.start_button.state(['disabled'])
-        thread = threading.Thread(target=self.run_migration, args=(source, dest, source_domain, target_domain))
+        self.stop_button.state(['!disabled'])
+        thread = threading.Thread(target=self.run_migration, args=(source, dest, source_domain, target_domain, options))
         thread.start()
 
     def stop_migration(self):
@@ -154,53 +207,77 @@ class MigrationUI:
         self.start_button.state(['!disabled'])
         self.stop_button.state(['disabled'])
 
-    def run_migration(self, source_email, dest_email, source_domain, target_domain):
+    def _migration_finished(self):
+        self.progress.stop()
+        self.start_button.state(['!disabled'])
+        self.stop_button.state(['disabled'])
+
+    def run_migration(self, source_email, dest_email, source_domain, target_domain, options):
+        drive_manager = None
         try:
             self.migration_running = True
-            self.stop_button.state(['!disabled'])
-            drive_manager = DriveManager()
+            drive_manager = DriveManager(source_email)
             drive_manager.set_ui(self)
+
+            if options['plan_only']:
+                self.update_status("Listing sources to plan the migration, nothing is transferred...")
+                plan = drive_manager.plan_migration(
+                    source_email, source_domain, target_domain,
+                    shared_drives=options['shared_drive'], shared_with_me=options['shared_with_me']
+                )
+                for line in MigrationPlanner.describe(plan):
+                    self.update_status(line)
+                return
+
+            if options['delta_sync']:
+                self.update_status("Syncing My Drive changes since last run...")
+                if drive_manager.sync_changes(source_email, dest_email, source_domain, target_domain):
+                    self.update_status("Delta sync completed successfully!")
+                else:
+                    self.update_status("Delta sync finished with errors, run it again to retry")
+                return
             
-            # Check latest log for completed downloads
-            log_dir = CONFIG['LOG_DIR']
-            latest_log = max([os.path.join(log_dir, f) for f in os.listdir(log_dir)], key=os.path.getctime)
-            zip_path = os.path.join(CONFIG['TEMP_DIR'], f"{source_email}_drive.zip")
-            
-            with open(latest_log, 'r') as f:
-                log_content = f.read()
-                
-            if "Completed downloading" in log_content and os.path.exists(zip_path):
-                self.update_status("Found previous download, skipping download phase...")
-            else:
-                self.update_status(f"Starting migration from {source_email} to {dest_email}")
-                
-                if self.my_drive_var.get():
+            self.update_status(f"Starting migration from {source_email} to {dest_email}")
+            # (scope, archive) pairs still to extract and upload
+            staged = []
+
+            if options['my_drive'] and options['direct_transfer']:
+                self.update_status("Migrating My Drive directly to destination...")
+                drive_manager.stream_drive(source_email, dest_email, source_domain, target_domain)
+                self.update_status("My Drive transfer completed")
+            elif options['my_drive']:
+                # Checkpoint of a finished My Drive download
+                if drive_manager.completed_archive('my_drive'):
+                    self.update_status("Found previous download, skipping download phase...")
+                else:
                     self.update_status("Migrating My Drive...")
-                    zip_path = drive_manager.download_drive(source_email)
-                    
-                if self.shared_drive_var.get():
-                    self.update_status("Checking Shared Drives...")
-                    shared_drives = drive_manager.list_shared_drives(source_email)
-                    if not shared_drives:
-                        self.update_status("No shared drives found, skipping...")
-                    else:
-                        shared_zip_path = drive_manager.download_shared_drive(source_email)
-                        if not zip_path:
-                            zip_path = shared_zip_path
-                            
-                if self.shared_with_me_var.get():
-                    self.update_status("Migrating Shared Files...")
-                    shared_files_zip_path = drive_manager.download_shared_with_me(source_email)
-                    if not zip_path:
-                        zip_path = shared_files_zip_path
+                staged.append(('my_drive', drive_manager.download_drive(source_email)))
+                
+            if options['shared_drive']:
+                self.update_status("Migrating Shared Drives, each into its own destination shared drive...")
+                failed = drive_manager.migrate_shared_drives(source_email, dest_email, source_domain, target_domain)
+                if failed:
+                    self.update_status(f"Shared drives that failed, run again to retry: {', '.join(failed)}")
+                else:
+                    self.update_status("Shared Drives transfer completed")
+                        
+            if options['shared_with_me']:
+                self.update_status("Migrating Shared Files...")
+                staged.append(('shared_with_me', drive_manager.download_shared_with_me(source_email)))
             
-            if zip_path and self.migration_running:
+            for scope, zip_path in staged:
+                if not self.migration_running:
+                    break
                 self.update_status("Extracting files...")
                 extract_path = drive_manager.extract_drive(zip_path)
                 
                 self.update_status("Uploading to destination...")
-                drive_manager.upload_drive(extract_path, dest_email, source_domain, target_domain)
-                
+                if scope == 'shared_with_me':
+                    drive_manager.upload_shared_with_me(extract_path, dest_email, source_domain, target_domain)
+                else:
+                    drive_manager.upload_drive(extract_path, dest_email, source_domain, target_domain)
+
+            if staged or options['shared_drive'] or (options['my_drive'] and options['direct_transfer']):
                 self.update_status("Migration completed successfully!")
             else:
                 self.update_status("No files selected for migration")
@@ -208,9 +285,9 @@ class MigrationUI:
         except Exception as e:
             self.update_status(f"Error: {str(e)}")
         finally:
-            self.progress.stop()
-            self.start_button.state(['!disabled'])
-            self.stop_button.state(['disabled'])
+            if drive_manager:
+                drive_manager.close()
+            self._post(self._migration_finished)
 
 def main():
     root = tk.Tk()
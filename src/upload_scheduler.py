@@ -0,0 +1,253 @@
+from googleapiclient.http import MediaFileUpload
+import os
+import queue
+import hashlib
+import logging
+import itertools
+import threading
+from drive_index import FOLDER_MIME_TYPE, SHORTCUT_MIME_TYPE
+from config import CONFIG
+
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CONFIG['DOWNLOAD_CHUNK_SIZE']), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadScheduler:
+    """Upload a local folder tree to the destination drive on a pool of workers.
+
+    The tree is treated as a dependency graph: a folder's contents are only
+    scheduled once the folder exists in the destination, and from then on
+    its sub-folders and files run in parallel. Folder creation jobs always
+    jump the queue so new branches of the tree open up as early as possible.
+    Progress is kept in the drive manager's state store under `scope`, so a
+    rerun skips finished files and reuses folders it already created. Items
+    the state store does not know about are also matched against the
+    destination index (same folder and name): identical files are skipped,
+    changed ones updated in place and existing folders reused. Shortcuts
+    are not in the archive; the ones the download recorded are created
+    last, when every folder they can point into exists.
+    """
+
+    FOLDER = 0
+    FILE = 1
+    STOP = 2
+
+    def __init__(self, drive_manager, root_path, scope, source_domain=None, target_domain=None, workers=None):
+        self.drive_manager = drive_manager
+        self.root_path = root_path
+        self.scope = scope
+        # rel_path -> dest_id of everything finished by an earlier run
+        self.uploaded = drive_manager.state.paths_in_phase(scope, 'uploaded')
+        self.source_domain = source_domain
+        self.target_domain = target_domain
+        self.workers = workers or CONFIG['UPLOAD_WORKERS']
+        self.jobs = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+
+    def run(self, parent_id):
+        threads = [
+            threading.Thread(target=self._worker, name=f'upload-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        self._submit(self.FOLDER, self._schedule_children, self.root_path, parent_id)
+        with self.idle:
+            while self.pending:
+                self.idle.wait()
+
+        for _ in threads:
+            self.jobs.put((self.STOP, next(self.sequence), None, ()))
+        for thread in threads:
+            thread.join()
+        self._create_shortcuts(parent_id)
+        return True
+
+    def _submit(self, priority, func, *args):
+        with self.lock:
+            self.pending += 1
+        self.jobs.put((priority, next(self.sequence), func, args))
+
+    def _worker(self):
+        while True:
+            _, _, func, args = self.jobs.get()
+            if func is None:
+                break
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Upload job failed: {str(e)}")
+            finally:
+                with self.idle:
+                    self.pending -= 1
+                    if not self.pending:
+                        self.idle.notify_all()
+
+    def _schedule_children(self, local_path, parent_id):
+        """Queue every item of a folder whose destination ID is now known"""
+        for item in os.listdir(local_path):
+            # Clean the filename before constructing paths
+            cleaned_item = self.drive_manager._clean_filename(item)
+            item_path = os.path.join(local_path, cleaned_item)
+            rel_path = os.path.relpath(item_path, self.root_path)
+
+            if not os.path.exists(item_path):
+                logging.warning(f"File not found, skipping: {item_path}")
+            elif os.path.isdir(item_path):
+                existing = self._existing(parent_id, cleaned_item, folder=True)
+                if self.uploaded.get(rel_path):
+                    # Created by an earlier run, carry on inside it
+                    self._submit(self.FOLDER, self._schedule_children, item_path, self.uploaded[rel_path])
+                elif existing:
+                    self._reuse_folder(rel_path, existing['id'])
+                    self._submit(self.FOLDER, self._schedule_children, item_path, existing['id'])
+                else:
+                    self._submit(self.FOLDER, self._create_folder, item, item_path, rel_path, parent_id)
+            elif rel_path in self.uploaded:
+                logging.info(f"Skipping already uploaded: {item}")
+            else:
+                self._submit(self.FILE, self._upload_file, item, item_path, rel_path, parent_id)
+
+    def _existing(self, parent_id, name, folder=False):
+        """Item the destination already had before this run, by folder and name"""
+        dest_index = self.drive_manager.dest_index
+        return dest_index.find(parent_id, name, folder) if dest_index else None
+
+    def _reuse_folder(self, rel_path, dest_id):
+        source_id = self._migrate_permissions(rel_path, dest_id)
+        self.drive_manager._store_file_mapping(
+            self.scope, rel_path, source_id, dest_id, mime_type=FOLDER_MIME_TYPE
+        )
+        logging.info(f"Reusing existing folder: {rel_path}")
+
+    def _report(self, name):
+        if hasattr(self.drive_manager, 'ui'):
+            self.drive_manager.ui.update_transfer_info(
+                name,
+                "Uploading",
+                self.drive_manager.current_file_count,
+                self.drive_manager.total_files
+            )
+
+    def _create_folder(self, item, item_path, rel_path, parent_id):
+        cleaned_item = os.path.basename(item_path)
+        try:
+            self._report(cleaned_item)
+            folder_metadata = {
+                'name': cleaned_item,
+                'mimeType': 'application/vnd.google-apps.folder',
+                'parents': [parent_id]
+            }
+            folder = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+                body=folder_metadata,
+                fields='id'
+            ))
+
+            source_id = self._migrate_permissions(rel_path, folder['id'])
+            self.drive_manager._store_file_mapping(
+                self.scope, rel_path, source_id, folder['id'], mime_type=FOLDER_MIME_TYPE
+            )
+            self._schedule_children(item_path, folder['id'])
+        except Exception as e:
+            logging.error(f"Error uploading {item}: {str(e)}")
+
+    def _upload_file(self, item, item_path, rel_path, parent_id):
+        cleaned_item = os.path.basename(item_path)
+        try:
+            self._report(cleaned_item)
+            size = os.path.getsize(item_path)
+            existing = self._existing(parent_id, cleaned_item)
+            known = self.drive_manager.state.get(self.scope, rel_path)
+            if existing and int(existing.get('size') or -1) == size:
+                # The download phase kept the source checksum, only exports need hashing
+                md5_checksum = (known or {}).get('md5_checksum') or _file_md5(item_path)
+            else:
+                md5_checksum = None
+
+            if md5_checksum and md5_checksum == existing.get('md5Checksum'):
+                dest_id = existing['id']
+                logging.info(f"Already in destination, skipping: {cleaned_item}")
+            else:
+                media = MediaFileUpload(item_path, chunksize=CONFIG['UPLOAD_CHUNK_SIZE'], resumable=True)
+                files = self.drive_manager.dest_service.files()
+                if existing:
+                    # Same name, different content: replace it instead of adding a duplicate
+                    request = files.update(fileId=existing['id'], media_body=media, fields='id')
+                else:
+                    request = files.create(
+                        body={'name': cleaned_item, 'parents': [parent_id]},
+                        media_body=media,
+                        fields='id'
+                    )
+                # Exports resume by the source version they were exported at
+                dest_id = self.drive_manager._resumable_upload(
+                    request, self.scope, rel_path,
+                    (known or {}).get('md5_checksum') or (known or {}).get('source_version')
+                )['id']
+                logging.info(f"{'Updated' if existing else 'Uploaded'}: {cleaned_item}")
+
+            source_id = self._migrate_permissions(rel_path, dest_id)
+            self.drive_manager._store_file_mapping(self.scope, rel_path, source_id, dest_id, size=size)
+            with self.drive_manager.progress_lock:
+                self.drive_manager.current_file_count += 1
+        except Exception as e:
+            logging.error(f"Error uploading {item}: {str(e)}")
+
+    def _create_shortcuts(self, parent_id):
+        state = self.drive_manager.state
+        folders = state.paths_in_phase(self.scope, 'uploaded')
+        folders[''] = parent_id
+        for shortcut in state.items_in_phase(self.scope, 'downloaded', SHORTCUT_MIME_TYPE):
+            rel_path = shortcut['rel_path']
+            try:
+                # Point at the migrated copy of the target when there is one
+                target_id = state.dest_id_for_source(shortcut['target_id']) or shortcut['target_id']
+                created = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+                    body={
+                        'name': os.path.basename(rel_path),
+                        'mimeType': SHORTCUT_MIME_TYPE,
+                        'shortcutDetails': {'targetId': target_id},
+                        'parents': [self._shortcut_folder(os.path.dirname(rel_path), folders)]
+                    },
+                    fields='id',
+                    supportsAllDrives=True
+                ))
+                self.drive_manager._store_file_mapping(
+                    self.scope, rel_path, shortcut['source_id'], created['id'], mime_type=SHORTCUT_MIME_TYPE
+                )
+                logging.info(f"Recreated shortcut: {rel_path}")
+            except Exception as e:
+                logging.error(f"Error recreating shortcut {rel_path}: {str(e)}")
+
+    def _shortcut_folder(self, rel_path, folders):
+        """Destination ID of a shortcut's folder, created when it held nothing but shortcuts"""
+        if rel_path not in folders:
+            parent_id = self._shortcut_folder(os.path.dirname(rel_path), folders)
+            folder = self.drive_manager._retry_upload(self.drive_manager.dest_service.files().create(
+                body={'name': os.path.basename(rel_path), 'mimeType': FOLDER_MIME_TYPE, 'parents': [parent_id]},
+                fields='id'
+            ))
+            source_id = self._migrate_permissions(rel_path, folder['id'])
+            self.drive_manager._store_file_mapping(
+                self.scope, rel_path, source_id, folder['id'], mime_type=FOLDER_MIME_TYPE
+            )
+            folders[rel_path] = folder['id']
+        return folders[rel_path]
+
+    def _migrate_permissions(self, rel_path, dest_id):
+        source_id, permissions = self.drive_manager.state.source_item(self.scope, rel_path)
+        if source_id:
+            self.drive_manager._migrate_sharing_permissions(
+                source_id, dest_id, self.source_domain, self.target_domain, permissions
+            )
+        return source_id
+